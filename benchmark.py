@@ -0,0 +1,225 @@
+import argparse
+import json
+import os
+import resource
+from timeit import default_timer
+
+import cv2
+import numpy as np
+
+from lib.processors_noopenmdao import findFaceGetPulse
+from lib.interface import render_plotXY
+from lib.profiling import Profiler
+from lib.synthetic import SyntheticFace
+
+"""
+Reproducible benchmarks of the signal and vision hot paths, run headless on
+synthetic frames (a rendered face pulsing at a known bpm).
+
+For every resolution the full findFaceGetPulse.run pipeline is driven with
+the GUI's settings, first while searching for the face and then while
+measuring, followed by isolated runs of detect_face, get_subface_means, the
+plotXY rendering and (if PyQt5 is installed) the CameraLabel frame
+conversions. Reports throughput, latency percentiles, peak memory and the
+bpm error against the rendered pulse.
+"""
+
+RESOLUTIONS = "320x240,640x480,1280x720,1920x1080"
+
+_qt_app = None
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def make_processor(profiler):
+    """
+    findFaceGetPulse set up like PulseApp, with timestamps taken as given
+    """
+    processor = findFaceGetPulse(bpm_limits=[50, 160],
+                                 data_spike_limit=2500.,
+                                 face_detector_smoothness=10.,
+                                 estimate_rate=4.,
+                                 detect_every=10,
+                                 detection_width=320,
+                                 detection_roi_pad=0.5,
+                                 peak_refinement="parabolic",
+                                 adaptive_window=True,
+                                 min_confidence=0.5,
+                                 profiler=profiler)
+    processor.t0 = 0.
+    return processor
+
+
+def time_calls(profiler, name, func, repeat):
+    for _ in xrange(repeat):
+        with profiler.stage(name):
+            func()
+
+
+def qt_converters():
+    """
+    Returns the CameraLabel frame conversions as (name, function) pairs, or
+    an empty list if PyQt5 is not available
+    """
+    try:
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+        from PyQt5.QtWidgets import QApplication
+        from lib.GUI_objects.CameraLabel import CameraLabel
+    except ImportError:
+        return []
+    global _qt_app
+    # Widgets need an application, which must outlive them
+    _qt_app = QApplication.instance() or QApplication([])
+    label = CameraLabel()
+    return [("ndarray_to_qimage", label.ndarray_to_qimage),
+            ("render_frame", lambda frame: label.render_frame(frame, 640))]
+
+
+def bench_resolution(width, height, frames, bpm, fps, noise, repeat, seed):
+    profiler = Profiler(window=max(frames, repeat))
+    source = SyntheticFace(width, height, bpm=bpm, noise=noise, seed=seed)
+    processor = make_processor(profiler)
+    t = 0.
+    rss_before = peak_rss_mb()
+
+    # Search for the face, as before the user locks it
+    search_frames = 0
+    while search_frames < 2 * fps:
+        processor.frame_in = source.render(t)
+        with profiler.stage("run_search"):
+            processor.run(0, t)
+        t += 1. / fps
+        search_frames += 1
+        if processor.face_found() and search_frames >= 10:
+            break
+    found = processor.face_found()
+
+    # Measure
+    estimates = []
+    last_idx = processor.idx
+    first_estimate = None
+    run_time = 0.
+    if found:
+        processor.start_measuring()
+        start = t
+        for _ in xrange(frames):
+            processor.frame_in = source.render(t)
+            begin = default_timer()
+            processor.run(0, t)
+            elapsed = default_timer() - begin
+            profiler.record("run_measure", elapsed)
+            run_time += elapsed
+            if processor.idx != last_idx:
+                last_idx = processor.idx
+                estimates.append(processor.bpm)
+                if first_estimate is None:
+                    first_estimate = t - start
+            t += 1. / fps
+
+    # Isolated hot paths. detect_face clears the sample buffers, so it runs
+    # after the plot of the measured data.
+    frame = source.render(t)
+    processor.frame_in = frame
+    processor.frame_out = frame.copy()
+    forehead = processor.get_subface_coord(0.5, 0.18, 0.25, 0.15)
+    time_calls(profiler, "get_subface_means",
+               lambda: processor.get_subface_means(forehead), repeat)
+    if len(processor.freqs) > 1:
+        plot_data = [[processor.times, processor.samples],
+                     [processor.freqs, processor.fft]]
+        time_calls(profiler, "plotXY",
+                   lambda: render_plotXY(plot_data, labels=[False, True],
+                                         showmax=[False, "bpm"],
+                                         label_ndigits=[0, 0],
+                                         showmax_digits=[0, 1],
+                                         skip=[3, 3],
+                                         bg=processor.slices[0]),
+                   repeat)
+    time_calls(profiler, "detect_face", processor.detect_face, repeat)
+    for name, convert in qt_converters():
+        time_calls(profiler, name, lambda: convert(frame), repeat)
+
+    summary = profiler.summary()
+    result = {"resolution": "%dx%d" % (width, height),
+              "face_found": found,
+              "stages": summary["stages"],
+              "throughput_fps": frames / run_time if run_time else 0.,
+              "peak_rss_mb": peak_rss_mb(),
+              "rss_growth_mb": peak_rss_mb() - rss_before,
+              "estimates": len(estimates),
+              "first_estimate_s": first_estimate}
+    if estimates:
+        late = np.array(estimates[len(estimates) // 2:])
+        result["bpm_last"] = estimates[-1]
+        result["bpm_error"] = abs(estimates[-1] - bpm)
+        result["bpm_median_error"] = float(np.median(np.abs(late - bpm)))
+    return result
+
+
+def print_result(result):
+    print("{0}: face found: {1}, measuring throughput {2:.1f} fps, "
+          "peak RSS {3:.1f} MB".format(result["resolution"],
+                                       result["face_found"],
+                                       result["throughput_fps"],
+                                       result["peak_rss_mb"]))
+    if "bpm_error" in result:
+        print("  {0} estimates, first after {1:.1f} s, last {2:.1f} bpm "
+              "(error {3:.2f}, median error {4:.2f})".format(
+                  result["estimates"], result["first_estimate_s"],
+                  result["bpm_last"], result["bpm_error"],
+                  result["bpm_median_error"]))
+    else:
+        print("  no estimates")
+    print("  {0:<20}{1:>8}{2:>10}{3:>10}{4:>10}{5:>10}".format(
+        "stage (ms)", "n", "p50", "p95", "p99", "max"))
+    for name in sorted(result["stages"]):
+        stats = result["stages"][name]
+        print("  {0:<20}{1:>8}{2:>10.3f}{3:>10.3f}{4:>10.3f}{5:>10.3f}".format(
+            name, stats["n"], stats["p50"], stats["p95"], stats["p99"],
+            stats["max"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmarks the pulse detector on synthetic frames.')
+    parser.add_argument('--resolutions', default=RESOLUTIONS,
+                        help='comma separated WIDTHxHEIGHT list')
+    parser.add_argument('--frames', type=int, default=600,
+                        help='frames processed while measuring')
+    parser.add_argument('--repeat', type=int, default=100,
+                        help='calls per isolated hot path')
+    parser.add_argument('--bpm', type=float, default=72.,
+                        help='heart rate of the synthetic pulse')
+    parser.add_argument('--fps', type=float, default=30.,
+                        help='frame rate of the synthetic timestamps')
+    parser.add_argument('--noise', type=float, default=1.,
+                        help='sensor noise (8-bit levels)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--threads', type=int, default=1,
+                        help='OpenCV threads (0 for the library default)')
+    parser.add_argument('--json', default=None,
+                        help='also write the results to this file')
+    args = parser.parse_args()
+
+    if args.threads:
+        cv2.setNumThreads(args.threads)
+    results = []
+    for resolution in args.resolutions.split(","):
+        width, height = [int(v) for v in resolution.lower().split("x")]
+        result = bench_resolution(width, height, args.frames, args.bpm,
+                                  args.fps, args.noise, args.repeat,
+                                  args.seed)
+        print_result(result)
+        results.append(result)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2,
+                      sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
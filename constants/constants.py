@@ -5,6 +5,38 @@ APP_SECRET = "some_app_secret"
 FOLDER = ".get_pulse"
 CONFIG_JSON_FILE = "config.json"
 WINDOWS = "Windows"
+# (connect, read) timeouts of API requests, in seconds
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 10
+REQUEST_TIMEOUT = (CONNECT_TIMEOUT, READ_TIMEOUT)
+# Keep-alive connections kept open to the API host
+CONNECTION_POOL_SIZE = 4
+# Measurement batches waiting for upload, and records per upload request
+UPLOAD_QUEUE_SIZE = 20
+UPLOAD_BATCH_SIZE = 200
+# Measurements are summarized per BATCH_INTERVAL seconds (up to
+# BATCH_MAX_INTERVAL while uploads lag behind) and queued for upload once
+# BATCH_MAX_BYTES of records were collected or BATCH_MAX_LATENCY seconds
+# passed
+BATCH_INTERVAL = 1.
+BATCH_MAX_INTERVAL = 8.
+BATCH_MAX_BYTES = 16384
+BATCH_MAX_LATENCY = 10.
+# Delay before retrying a failed upload, doubled on every failure (seconds)
+RETRY_DELAY = 1
+MAX_RETRY_DELAY = 60
+# Uploads of a batch are given up after MAX_UPLOAD_ATTEMPTS failed requests
+# the server answered, or once it is MAX_UPLOAD_AGE seconds old
+MAX_UPLOAD_ATTEMPTS = 10
+MAX_UPLOAD_AGE = 7 * 24 * 3600
+# Batches are kept in FOLDER/OUTBOX_FOLDER until they were uploaded
+OUTBOX_FOLDER = "outbox"
+# Image name -> id cache in FOLDER, and threads registering new images
+IMAGE_CACHE_FILE = "image_ids.json"
+IMAGE_LOOKUP_WORKERS = 4
+# "json" always sends bulk records as JSON. "binary" uses the compact
+# RecordCodec encoding if the server advertises it, and JSON otherwise
+RECORD_ENCODING = "json"
 delimiter = ""
 
 
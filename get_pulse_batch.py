@@ -0,0 +1,81 @@
+import argparse
+import multiprocessing
+import os
+
+from lib.batch import is_samples_csv, process_paths
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Headless webcam pulse detector for recorded videos.')
+    parser.add_argument('inputs', nargs='*',
+                        help='video files, directories of video files, or '
+                             'sample .csv files saved by the GUI (of the '
+                             'estimation options, these only take '
+                             '--peak-refinement)')
+    parser.add_argument('--camera', type=int, action='append', default=[],
+                        help='also process this camera index (repeatable)')
+    parser.add_argument('--max-frames', type=int, default=None,
+                        help='stop each stream after this many frames '
+                             '(required for cameras)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes, one stream each')
+    parser.add_argument('--output', default='.',
+                        help='directory for the <video>_bpm.csv series')
+    parser.add_argument('--estimator', default='fft',
+                        choices=['fft', 'sliding'],
+                        help='spectral estimator used for the bpm')
+    parser.add_argument('--estimate-rate', type=float, default=4.,
+                        help='bpm estimates per second of video')
+    parser.add_argument('--peak-refinement', default='parabolic',
+                        choices=['none', 'parabolic', 'zoom'],
+                        help='sub-bin refinement of the spectral peak')
+    parser.add_argument('--min-confidence', type=float, default=0.,
+                        help='drop estimates whose peak confidence (0-1) is '
+                             'lower (with --adaptive-window only the first '
+                             'estimate)')
+    parser.add_argument('--adaptive-window', action='store_true',
+                        help='make the first estimate from a short window, '
+                             'grown until it reaches --min-confidence')
+    parser.add_argument('--detection-width', type=int, default=320,
+                        help='frame width used for face detection (at '
+                             'least 0.4 times the video width, so that '
+                             '50 px faces are still found)')
+
+    args = parser.parse_args()
+    if not args.inputs and not args.camera:
+        parser.error('no video files or cameras given')
+    if args.camera and args.max_frames is None:
+        parser.error('--max-frames is required with --camera')
+    # Sample files are analysed by offline_bpm, with one estimate per sample
+    # over a fixed window
+    if any(is_samples_csv(path) for path in args.inputs) and \
+            (args.estimator != parser.get_default('estimator') or
+             args.estimate_rate != parser.get_default('estimate_rate') or
+             args.adaptive_window or args.min_confidence):
+        parser.error('--estimator, --estimate-rate, --adaptive-window and '
+                     '--min-confidence do not apply to sample .csv files, '
+                     'process them in a separate run')
+    peak_refinement = None
+    if args.peak_refinement != 'none':
+        peak_refinement = args.peak_refinement
+    if not os.path.exists(args.output):
+        os.makedirs(args.output)
+
+    process_paths(args.inputs, args.output,
+                  workers=args.workers,
+                  cameras=args.camera,
+                  max_frames=args.max_frames,
+                  estimator=args.estimator,
+                  estimate_rate=args.estimate_rate,
+                  peak_refinement=peak_refinement,
+                  adaptive_window=args.adaptive_window,
+                  min_confidence=args.min_confidence,
+                  detect_every=10,
+                  detection_width=args.detection_width,
+                  detection_roi_pad=0.5)
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    main()
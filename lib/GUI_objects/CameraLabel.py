@@ -1,16 +1,16 @@
 import argparse
 import threading
 
-from PyQt5.QtCore import Qt, QSize, pyqtSignal
+import cv2
+import numpy as np
+from PyQt5.QtCore import QSize, pyqtSignal
 from PyQt5.QtGui import QPixmap, QImage
 from PyQt5.QtWidgets import QLabel
 
-from lib.PulseApp import PulseApp
-
 
 class CameraLabel(QLabel):
 
-    display_camera_signal = pyqtSignal(QPixmap)
+    display_camera_signal = pyqtSignal(QImage)
 
     def __init__(self, parent=None):
         super(CameraLabel, self).__init__(parent=parent)
@@ -25,6 +25,12 @@ class CameraLabel(QLabel):
         self.image_width_minimum = 400
         self.image_width_normal = 640
 
+        # Frames are rendered into a reused buffer that the emitted QImage
+        # wraps without copying. While the UI thread has not displayed the
+        # previous frame, new frames are not rendered (they are skipped).
+        self.display_buffer = None
+        self.frame_pending = threading.Event()
+
         self.display_camera_signal.connect(self.display_camera_image)
 
     def _create_pulse_detector(self, data):
@@ -35,9 +41,26 @@ class CameraLabel(QLabel):
                             help='Baud rate for serial transmission')
         parser.add_argument('--udp', default=None,
                             help='udp address:port destination for bpm data')
+        parser.add_argument('--source', default=None,
+                            help='read frames from a video file, image '
+                                 'directory, .npy file or "synthetic[:BPM]" '
+                                 'instead of a camera')
+        parser.add_argument('--profile', default=None,
+                            help='write per-stage timings to this .json or '
+                                 '.csv file on exit')
+        parser.add_argument('--metrics-port', default=None,
+                            help='serve per-stage timings as JSON on this '
+                                 'local port')
+        parser.add_argument('--min-confidence', type=float, default=0.5,
+                            help='peak confidence (0-1) the first estimate '
+                                 'after a face was found must reach')
 
         args = parser.parse_args()
         if self.pulse_detector is None:
+            # Imported on first use, the detector pulls in the face
+            # detection, signal processing, network and serial port modules.
+            # OpenCV itself is already loaded for render_frame.
+            from lib.PulseApp import PulseApp
             pulse_detector = PulseApp(args)
             pulse_detector.setAppData(data)
             self.measurement_signal = pulse_detector.measurement_signal
@@ -57,18 +80,40 @@ class CameraLabel(QLabel):
             # Take camera image and process it
             self.pulse_detector.main_loop()
 
+            # Skip this frame if the UI thread is still busy with the last one
+            if self.frame_pending.is_set():
+                self.pulse_detector.profiler.count("skipped_frames")
+                continue
+
             # Get processed Image and show it in Label (self)
             ndarray_image = self.pulse_detector.processor.frame_out
-            q_img = self.ndarray_to_qimage(ndarray_image)
-            if self.scale_image_down:
-                q_pixmap = QPixmap(q_img).scaledToWidth(self.image_width_minimum, Qt.SmoothTransformation)
-            else:
-                q_pixmap = QPixmap(q_img).scaledToWidth(self.image_width_normal, Qt.SmoothTransformation)
+            with self.pulse_detector.profiler.stage("render"):
+                if self.scale_image_down:
+                    q_img = self.render_frame(ndarray_image, self.image_width_minimum)
+                else:
+                    q_img = self.render_frame(ndarray_image, self.image_width_normal)
             # Send signal to UI thread to display the image
-            self.display_camera_signal.emit(q_pixmap)
+            self.frame_pending.set()
+            self.display_camera_signal.emit(q_img)
 
-    def display_camera_image(self, q_pixmap):
-        self.setPixmap(q_pixmap)
+    def display_camera_image(self, q_img):
+        # fromImage copies the pixels, after which the buffer may be reused
+        with self.pulse_detector.profiler.stage("display"):
+            self.setPixmap(QPixmap.fromImage(q_img))
+        self.frame_pending.clear()
+
+    def render_frame(self, ndarray, width):
+        """
+        Resizes a BGR frame to the given width and converts it to RGB, both
+        in place in the preallocated display buffer, and wraps the buffer
+        in a QImage without copying.
+        """
+        height = int(round(ndarray.shape[0] * width / float(ndarray.shape[1])))
+        if self.display_buffer is None or self.display_buffer.shape != (height, width, 3):
+            self.display_buffer = np.empty((height, width, 3), dtype=np.uint8)
+        cv2.resize(ndarray, (width, height), dst=self.display_buffer, interpolation=cv2.INTER_AREA)
+        cv2.cvtColor(self.display_buffer, cv2.COLOR_BGR2RGB, dst=self.display_buffer)
+        return QImage(self.display_buffer.data, width, height, 3 * width, QImage.Format_RGB888)
 
     def ndarray_to_qimage(self, ndarray):
         height, width, channel = ndarray.shape
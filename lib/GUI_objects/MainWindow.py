@@ -1,14 +1,21 @@
+import os
 import threading
 import time
+from os.path import expanduser
 
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QTimer
 from PyQt5.QtGui import QColor, QIcon
 from PyQt5.QtWidgets import QWidget, QHBoxLayout, QMainWindow, QMessageBox
 
+from constants import constants
 from lib.GUI_objects.CameraLabel import CameraLabel
 from lib.GUI_objects.ImageWindow import ImageWindow
 from lib.GUI_objects.Ui_Form import Ui_Form
+from lib.network.ImageCache import ImageCache
+from lib.network.MeasurementBatcher import MeasurementBatcher
 from lib.network.NetworkHelper import NetworkHelper
+from lib.network.Outbox import Outbox
+from lib.network.Uploader import Uploader
 
 
 class MainWindow(QMainWindow):
@@ -47,10 +54,21 @@ class MainWindow(QMainWindow):
         p.setColor(self.foregroundRole(), Qt.white)
         self.setPalette(p)
 
-        self.images = []
-        self.bpm_array = []
+        self.image_cache = ImageCache(os.path.join(expanduser("~"), constants.FOLDER,
+                                                   constants.IMAGE_CACHE_FILE))
+        self.batcher = MeasurementBatcher(max_count=self.MEASUREMENTS_COUNT_LIMIT)
         self.data = None
         self.session_id = None
+        # Measurements are uploaded by one background worker. They are kept
+        # on disk until the upload succeeded, and batches left over from an
+        # earlier run are sent again.
+        outbox = Outbox(os.path.join(expanduser("~"), constants.FOLDER,
+                                     constants.OUTBOX_FOLDER))
+        self.uploader = Uploader(self.__send_measurement, outbox=outbox)
+        # Batches also become due by age, when no new estimates come in
+        self.batch_timer = QTimer(self)
+        self.batch_timer.timeout.connect(self.batch_timer_slot)
+        self.batch_timer.start(int(1000 * constants.BATCH_INTERVAL))
 
     def form_ok_callback(self):
         if self.form_window and self.form_window.check_state(None):
@@ -72,6 +90,10 @@ class MainWindow(QMainWindow):
                 # Start camera
                 ###############
                 self.camera_label.open_camera(self.data)
+                # Uploads are profiled along with the pulse detector
+                profiler = self.camera_label.pulse_detector.profiler
+                self.uploader.profiler = profiler
+                NetworkHelper.profiler = profiler
 
                 ###########################
                 # Connect signals to slots
@@ -81,43 +103,51 @@ class MainWindow(QMainWindow):
 
     def measurement_slot(self):
         if self.image_widget.current_showing_image is not None and self.session_id is not None:
-            single_measurement = {"value": self.camera_label.get_measurement(),
-                                  "time": NetworkHelper.get_formatted_time(time.time()),
-                                  "image": self.image_widget.current_showing_image}
-            self.bpm_array.append(single_measurement)
-            if len(self.bpm_array) == self.MEASUREMENTS_COUNT_LIMIT:
+            # Estimates are summarized per interval, and queued once the
+            # batch is large or old enough
+            now = time.time()
+            self.batcher.add(self.camera_label.get_measurement(),
+                             self.image_widget.current_showing_image, now)
+            if self.batcher.due(now):
                 self.send_measurements()
 
+    def batch_timer_slot(self):
+        if self.batcher.due():
+            self.send_measurements()
+
     def send_measurements(self):
-        if self.data is None or len(self.bpm_array) == 0:
+        if self.data is None or len(self.batcher) == 0:
             return
-        records = self.bpm_array[:self.MEASUREMENTS_COUNT_LIMIT]
-        self.bpm_array = self.bpm_array[self.MEASUREMENTS_COUNT_LIMIT:]
-
-        t = threading.Thread(target=self.__send_measurement, kwargs={'records':records})
-        t.start()
-
-    def __send_measurement(self, records):
-        # Get images from database if not already cached
-        missing_images = list({bpm['image'] for bpm in records if bpm['image']
-                               not in [image['name'] for image in self.images]})
-        for img in missing_images:
-            self.__get_image(img)
-
-        # replace all records name with id
+        records = self.batcher.take()
+
+        if not self.uploader.submit(self.session_id, records):
+            # Only without an outbox: keep them for the next attempt, in
+            # coarser intervals
+            self.batcher.put_back(records)
+        self.batcher.adapt(self.uploader.pending(), constants.UPLOAD_QUEUE_SIZE)
+
+    def __send_measurement(self, session_id, records):
+        # Get image ids, from the cache or the database
+        image_ids = self.image_cache.resolve(r['image'] for r in records if r['image'])
+        unresolved = set(r['image'] for r in records
+                         if r['image'] and r['image'] not in image_ids)
+        if unresolved:
+            # The batch fails like its image registration: retried while the
+            # host does not answer, otherwise counted towards the upload
+            # attempts, or given up on if an image was refused (4xx)
+            statuses = [self.image_cache.errors.get(name) for name in unresolved]
+            answered = sorted(status for status in statuses if status is not None)
+            return False, answered[0] if answered else None
+
+        # replace all records name with id, in copies so that retried
+        # batches still carry the names
+        records = [dict(r) for r in records]
         for r in records:
-            img_id = [img['id'] for img in self.images if r['image'] == img['name']]
-            if not img_id:
-                continue
-            r['image'] = img_id[0]
+            if r['image'] in image_ids:
+                r['image'] = image_ids[r['image']]
 
         # send measurements (records)
-        NetworkHelper.add_record_bulk(self.session_id, records)
-
-    def __get_image(self, img):
-        success, full_img = NetworkHelper.add_image({'name': img})
-        if success and full_img['id'] not in [image['id'] for image in self.images]:
-            self.images.append(full_img)
+        return NetworkHelper.add_record_bulk(session_id, records)
 
     def form_cancel_callback(self):
         self.close()
@@ -138,10 +168,17 @@ class MainWindow(QMainWindow):
 
         self.camera_label.cleanup()
         self.image_widget.cleanup()
+        # Queue what the batcher still holds, then send what is queued,
+        # without hanging on an unreachable host
+        self.batch_timer.stop()
+        self.send_measurements()
+        self.uploader.close(timeout=2 * sum(constants.REQUEST_TIMEOUT))
+        self.image_cache.close()
 
         main_thread = threading.currentThread()
         for t in threading.enumerate():
-            if t is main_thread:
+            # Daemon threads (uploads, camera probes) need not be waited for
+            if t is main_thread or t.daemon:
                 continue
             print('joining %s' % t.getName())
             t.join()
@@ -1,16 +1,18 @@
 import datetime
 import socket
 import sys
+import threading
 import time
 
 import numpy as np
 from PyQt5.QtCore import QObject, pyqtSignal
 from serial import Serial
 
-from lib.device import Camera
+from lib.device import Camera, error_frame, open_source, probe_cameras
 from lib.interface import destroyWindow, moveWindow, plotXY, waitKey
 from lib.network.NetworkHelper import NetworkHelper
 from lib.processors_noopenmdao import findFaceGetPulse
+from lib.profiling import NULL_PROFILER, Profiler
 
 
 class PulseApp(QObject):
@@ -28,6 +30,8 @@ class PulseApp(QObject):
         super(PulseApp, self).__init__(parent=parent)
 
         self.bpm = 0
+        # processor.idx of the last emitted estimate
+        self.last_idx = None
 
         # Imaging device - must be a connected camera (not an ip camera or mjpeg
         # stream)
@@ -56,14 +60,34 @@ class PulseApp(QObject):
             self.sock = socket.socket(socket.AF_INET,  # Internet
                                       socket.SOCK_DGRAM)  # UDP
 
+        # Stage timings are only collected when they are exported to a file
+        # (--profile) or served on a local port (--metrics-port)
+        self.profile_path = args.profile
+        self.profiler = NULL_PROFILER
+        if args.profile or args.metrics_port:
+            self.profiler = Profiler()
+        if args.metrics_port:
+            self.profiler.serve(int(args.metrics_port))
+
         self.cameras = []
         self.selected_cam = 0
-        for i in xrange(3):
-            camera = Camera(camera=i)  # first camera by default
-            if camera.valid or not len(self.cameras):
-                self.cameras.append(camera)
-            else:
-                break
+        if args.source:
+            # Recorded or synthetic frames instead of a camera, paced like a
+            # live camera and looped
+            self.cameras.append(open_source(args.source, realtime=True,
+                                            loop=True))
+        else:
+            # Only the first camera is opened, by its own grabbing thread,
+            # so a slow or missing device does not hold up startup. The
+            # other indices are probed in the background and only opened
+            # when toggle_cam selects them.
+            self.cameras.append(Camera(camera=0, lazy=True))
+            probe = threading.Thread(target=self.probe_cameras)
+            probe.daemon = True
+            probe.start()
+        self.cameras[0].profiler = self.profiler
+        # Only the selected camera grabs frames, in its own thread
+        self.cameras[self.selected_cam].start()
         self.w, self.h = 0, 0
         self.pressed = 0
         # Containerized analysis of recieved image frames (an openMDAO assembly)
@@ -75,9 +99,23 @@ class PulseApp(QObject):
 
         # Basically, everything that isn't communication
         # to the camera device or part of the GUI
+        # The bpm estimate only changes a few times per second, so the
+        # spectral analysis is refreshed at estimate_rate (Hz) while samples
+        # are still collected on every frame. The face cascade runs every
+        # detect_every frames on a copy shrunk to detection_width pixels,
+        # around the last face if one was seen, and the face is tracked in
+        # between.
         self.processor = findFaceGetPulse(bpm_limits=[50, 160],
                                           data_spike_limit=2500.,
-                                          face_detector_smoothness=10.)
+                                          face_detector_smoothness=10.,
+                                          estimate_rate=4.,
+                                          detect_every=10,
+                                          detection_width=320,
+                                          detection_roi_pad=0.5,
+                                          peak_refinement="parabolic",
+                                          adaptive_window=True,
+                                          min_confidence=args.min_confidence,
+                                          profiler=self.profiler)
 
         # Init parameters for the cardiac data plot
         self.bpm_plot = False
@@ -89,13 +127,25 @@ class PulseApp(QObject):
             "s": self.toggle_search
         }
 
+    def probe_cameras(self):
+        """
+        Adds the working cameras among indices 1 and 2, unopened
+        """
+        for index in probe_cameras((1, 2), timeout=2.):
+            camera = Camera(camera=index, lazy=True)
+            camera.profiler = self.profiler
+            self.cameras.append(camera)
+
     def toggle_cam(self):
         if len(self.cameras) > 1:
             self.processor.find_faces = True
             self.bpm_plot = False
             destroyWindow(self.plot_title)
+            # Only the selected camera is kept open
+            self.cameras[self.selected_cam].release()
             self.selected_cam += 1
             self.selected_cam = self.selected_cam % len(self.cameras)
+            self.cameras[self.selected_cam].start()
 
     def write_csv(self):
         """
@@ -119,11 +169,8 @@ class PulseApp(QObject):
         print "face detection lock =", not state
 
     def start_measuring(self):
-        self.processor.find_faces = False
-        self.processor.start_time = self.processor.get_current_time()
-        self.processor.end_time = self.data[u"record_length"] + self.processor.start_time
+        self.processor.start_measuring(self.data[u"record_length"])
         self.processor.data = self.data
-        self.processor.heart_rates = []
 
     def stop_measuring(self):
         self.processor.find_faces = True
@@ -190,22 +237,33 @@ class PulseApp(QObject):
         #################
         # Image Process #
         #################
-        # Get next image frame from the camera
-        frame = self.cameras[self.selected_cam].get_frame()
+        # Get the freshest image frame from the camera, along with the time
+        # it was grabbed at
+        self.profiler.tick("loop")
+        with self.profiler.stage("capture"):
+            frame, timestamp = self.cameras[self.selected_cam].get_timed_frame()
+        if frame is None:
+            frame, timestamp = error_frame(), time.time()
         self.h, self.w, _c = frame.shape
 
         # set current image frame to the processor's input
         self.processor.frame_in = frame
         # process the image frame to perform all needed analysis
-        self.processor.run(self.selected_cam)
+        with self.profiler.stage("process"):
+            self.processor.run(self.selected_cam, timestamp)
         # self.processor.frame_out is accessed directly for displaying
 
         ################
         # Data Process #
         ################
-        if self.processor.bpm != 0:
-            self.bpm = self.processor.bpm
-            self.measurement_signal.emit()
+        # Only new estimates are emitted, a few times per second rather than
+        # on every frame. Estimates made before the first confident one are
+        # only shown in the overlay.
+        if self.processor.idx != self.last_idx:
+            self.last_idx = self.processor.idx
+            if self.processor.bpm != 0:
+                self.bpm = self.processor.bpm
+                self.measurement_signal.emit()
 
         """
         # Record length condition checking
@@ -222,11 +280,12 @@ class PulseApp(QObject):
         if self.bpm_plot:
             self.make_bpm_plot()
 
-        if self.send_serial:
-            self.serial.write(str(self.processor.bpm) + "\r\n")
+        with self.profiler.stage("publish"):
+            if self.send_serial:
+                self.serial.write(str(self.processor.bpm) + "\r\n")
 
-        if self.send_udp:
-            self.sock.sendto(str(self.processor.bpm), self.udp)
+            if self.send_udp:
+                self.sock.sendto(str(self.processor.bpm), self.udp)
 
     def upload_measurements(self):
         is_success, _ = NetworkHelper.add_record(int(self.data[u"user_id"]), int(self.data[u"record_length"]),
@@ -268,7 +327,11 @@ class PulseApp(QObject):
             print("Signal in PulseApp was not connected.")
         
         for cam in self.cameras:
-            cam.cam.release()
+            cam.release()
         if self.send_serial:
             self.serial.close()
+        if self.profile_path:
+            self.profiler.export(self.profile_path)
+            print("Wrote profile to {0}".format(self.profile_path))
+        self.profiler.close()
         print("Closed Pulse App")
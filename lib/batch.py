@@ -0,0 +1,210 @@
+import multiprocessing
+import os
+
+import cv2
+import numpy as np
+
+from lib.device import Camera, VideoFile
+from lib.processors_noopenmdao import findFaceGetPulse
+from lib.signalProcess import load_samples_csv, offline_bpm
+
+"""
+Headless processing of recorded video files and cameras.
+
+Frames are fed through findFaceGetPulse as fast as they decode, using the
+timestamps stored in the container, and every refreshed estimate is
+collected into a (time, bpm) series. Several streams can be fanned out over
+a pool of worker processes, each running its own processor. Sample files
+saved by the GUI are analysed directly with the batched offline_bpm.
+"""
+
+VIDEO_EXTENSIONS = (".avi", ".mp4", ".mov", ".mkv", ".m4v", ".mpg", ".mpeg",
+                    ".wmv")
+
+
+def find_videos(paths):
+    """
+    Expands directories in paths into the video files they contain
+    """
+    videos = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith(VIDEO_EXTENSIONS):
+                    videos.append(os.path.join(path, name))
+        else:
+            videos.append(path)
+    return videos
+
+
+def make_processor(**processor_args):
+    """
+    findFaceGetPulse set up for headless use: estimates at 4 Hz, no
+    drawing, and timestamps used as given by the source
+    """
+    processor_args.setdefault("estimate_rate", 4.)
+    processor_args.setdefault("draw_overlay", False)
+    processor = findFaceGetPulse(**processor_args)
+    processor.t0 = 0.
+    return processor
+
+
+def process_source(source, max_frames=None, processor=None,
+                   **processor_args):
+    """
+    Runs a frame source through a headless findFaceGetPulse (made with
+    make_processor unless one is given).
+
+    The face is locked as soon as it has been found, after which the
+    forehead signal is collected. Returns an (n, 2) array holding the time
+    (seconds, as reported by the source) and bpm of every estimate.
+    """
+    if processor is None:
+        processor = make_processor(**processor_args)
+
+    series = []
+    last_idx = processor.idx
+    frames = 0
+    while max_frames is None or frames < max_frames:
+        frame, timestamp = source.get_timed_frame()
+        if frame is None:
+            break
+        frames += 1
+
+        processor.frame_in = frame
+        processor.run(0, timestamp)
+        if processor.find_faces and processor.face_found():
+            processor.start_measuring()
+        if processor.idx != last_idx:
+            last_idx = processor.idx
+            series.append((timestamp, processor.bpm))
+
+    return np.array(series).reshape(-1, 2)
+
+
+def process_video(path, max_frames=None, **processor_args):
+    """
+    Returns the (time, bpm) series of a video file, see process_source
+    """
+    video = VideoFile(path)
+    if not video.valid:
+        raise IOError("Could not open video file: {0}".format(path))
+    try:
+        return process_source(video, max_frames, **processor_args)
+    finally:
+        video.release()
+
+
+def is_samples_csv(stream):
+    return not isinstance(stream, int) and stream.lower().endswith(".csv")
+
+
+def process_samples_csv(path, refine=False):
+    """
+    Returns the per-sample (time, bpm) series of a sample file written by
+    PulseApp.write_csv, computed in one batched pass by offline_bpm
+    """
+    times, samples = load_samples_csv(path)
+    return offline_bpm(times, samples, refine=refine)
+
+
+def write_series(path, series):
+    np.savetxt(path, series, fmt="%.3f", delimiter=',', header="time,bpm",
+               comments="")
+
+
+def stream_name(stream):
+    if isinstance(stream, int):
+        return "camera{0}".format(stream)
+    return os.path.splitext(os.path.basename(stream))[0]
+
+
+def series_path(stream, output_dir):
+    return os.path.join(output_dir, stream_name(stream) + "_bpm.csv")
+
+
+def _process_stream(task):
+    """
+    Worker process entry point. Streams are camera indices (ints), video
+    file paths, or sample files written by PulseApp.write_csv. Returns
+    (stream, series, overlay, error), where overlay is the last annotated
+    frame if it was requested.
+    """
+    stream, max_frames, keep_overlay, processor_args = task
+    if is_samples_csv(stream):
+        try:
+            refine = processor_args.get("peak_refinement") is not None
+            return stream, process_samples_csv(stream, refine), None, None
+        except Exception as err:
+            return stream, None, None, str(err)
+
+    # One stream per process, OpenCV's own threads would only compete
+    cv2.setNumThreads(1)
+    if keep_overlay:
+        processor_args["draw_overlay"] = True
+    if isinstance(stream, int):
+        source = Camera(camera=stream, threaded=True)
+    else:
+        source = VideoFile(stream)
+    try:
+        if not source.valid:
+            raise IOError("Could not open stream: {0}".format(stream))
+        processor = make_processor(**processor_args)
+        series = process_source(source, max_frames, processor)
+        overlay = processor.frame_out if keep_overlay else None
+        return stream, series, overlay, None
+    except Exception as err:
+        return stream, None, None, str(err)
+    finally:
+        source.release()
+
+
+def process_streams(streams, workers=None, max_frames=None,
+                    keep_overlay=False, **processor_args):
+    """
+    Processes several streams (camera indices or video paths) in a pool of
+    worker processes, one processor instance per stream. Yields
+    (stream, series, overlay, error) tuples as streams finish. Live cameras
+    run until max_frames frames were processed.
+    """
+    tasks = [(stream, max_frames, keep_overlay, dict(processor_args))
+             for stream in streams]
+    pool = multiprocessing.Pool(workers)
+    try:
+        for result in pool.imap_unordered(_process_stream, tasks):
+            yield result
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def process_paths(paths, output_dir=".", workers=1, cameras=(),
+                  max_frames=None, **processor_args):
+    """
+    Processes every video in paths (files or directories), and every camera
+    index in cameras, and writes one <name>_bpm.csv series per stream into
+    output_dir. With workers > 1 the streams are spread over that many
+    processes. Returns the written file names.
+    """
+    streams = list(cameras) + find_videos(paths)
+    if workers > 1:
+        results = process_streams(streams, workers, max_frames,
+                                   **processor_args)
+    else:
+        results = (_process_stream((stream, max_frames, False,
+                                    dict(processor_args)))
+                   for stream in streams)
+
+    written = []
+    for stream, series, _, error in results:
+        if error is not None:
+            print("{0}: {1}".format(stream, error))
+            continue
+        out = series_path(stream, output_dir)
+        write_series(out, series)
+        print("{0}: {1} estimates -> {2}".format(stream, len(series), out))
+        written.append(out)
+    return written
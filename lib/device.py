@@ -1,7 +1,22 @@
 import cv2, time
+import os
+import threading
 import urllib2, base64
+from collections import deque
 import numpy as np
 
+from lib.profiling import NULL_PROFILER
+from lib.synthetic import SyntheticFace
+
+
+def error_frame():
+    frame = np.ones((480, 640, 3), dtype=np.uint8)
+    col = (0, 256, 256)
+    cv2.putText(frame, "(Error: Camera not accessible)",
+                (65, 220), cv2.FONT_HERSHEY_PLAIN, 2, col)
+    return frame
+
+
 class ipCamera(object):
     def __init__(self, url, user=None, password=None):
         self.url = url
@@ -16,28 +31,393 @@ class ipCamera(object):
         frame = cv2.imdecode(img_array, 1)
         return frame
 
+    def get_timed_frame(self):
+        timestamp = time.time()
+        return self.get_frame(), timestamp
+
 
 class Camera(object):
-    def __init__(self, camera=0):
-        self.cam = cv2.VideoCapture(camera)
+    """
+    Local camera device.
+
+    With threaded=True (or after start()) frames are grabbed by a background
+    thread into a ring of queue_size frames, each stamped with the time it
+    was grabbed. When the ring is full the oldest frame is dropped, and
+    get_frame always returns the freshest frame, discarding older unread
+    ones. dropped_frames counts frames that were never returned. Grabbed
+    and dropped frames are also reported to profiler, as the "camera" rate
+    and the "dropped_frames" counter.
+
+    With lazy=True the device is not opened by the constructor but by
+    start(), in the grabbing thread, so a slow or missing device never
+    blocks the caller. Error frames are returned until it delivers frames.
+    """
+
+    def __init__(self, camera=0, threaded=False, queue_size=2, lazy=False):
+        self.camera = camera
+        self.cam = None
         self.valid = False
+        self.shape = None
+        if not lazy:
+            self.open()
+
+        self.frames = deque(maxlen=queue_size)
+        self.dropped_frames = 0
+        self.profiler = NULL_PROFILER
+        self.frame_timeout = 1.
+        self._frame_ready = threading.Condition()
+        self._capturing = False
+        self._thread = None
+        if threaded:
+            self.start()
+
+    def open(self):
+        """
+        Opens the device and reads a first frame, which sets valid and shape
+        """
+        if self.cam is not None:
+            return self.valid
+        self.cam = cv2.VideoCapture(self.camera)
         try:
             resp = self.cam.read()
             self.shape = resp[1].shape
             self.valid = True
         except:
             self.shape = None
+        return self.valid
 
-    def get_frame(self):
-        if self.valid:
-            _, frame = self.cam.read()
-        else:
-            frame = np.ones((480, 640, 3), dtype=np.uint8)
-            col = (0, 256, 256)
-            cv2.putText(frame, "(Error: Camera not accessible)",
-                        (65, 220), cv2.FONT_HERSHEY_PLAIN, 2, col)
+    def start(self):
+        """
+        Starts grabbing frames in a background thread, opening the device
+        first if that was deferred
+        """
+        if self._capturing or (self.cam is not None and not self.valid):
+            return
+        self._capturing = True
+        self._thread = threading.Thread(target=self._capture)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the background thread, frames are read on demand again
+        """
+        self._capturing = False
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join()
+        self._thread = None
+        with self._frame_ready:
+            self.frames.clear()
+
+    def _capture(self):
+        if not self.open():
+            with self._frame_ready:
+                self._capturing = False
+                self._frame_ready.notify_all()
+            return
+        while self._capturing:
+            ok, frame = self.cam.read()
+            timestamp = time.time()
+            if not ok or frame is None:
+                time.sleep(0.01)
+                continue
+            frame = cv2.flip(frame, 1)
+            self.profiler.tick("camera")
+            with self._frame_ready:
+                if len(self.frames) == self.frames.maxlen:
+                    self.dropped_frames += 1
+                    self.profiler.count("dropped_frames")
+                self.frames.append((frame, timestamp))
+                self._frame_ready.notify()
+
+    def get_timed_frame(self):
+        """
+        Returns the next frame and the time (time.time()) it was grabbed
+        """
+        if self._capturing:
+            with self._frame_ready:
+                if not self.frames:
+                    self._frame_ready.wait(self.frame_timeout)
+                if self.frames:
+                    frame, timestamp = self.frames.pop()
+                    self.dropped_frames += len(self.frames)
+                    self.profiler.count("dropped_frames", len(self.frames))
+                    self.frames.clear()
+                    return frame, timestamp
+            return error_frame(), time.time()
+
+        if not self.open():
+            return error_frame(), time.time()
+        _, frame = self.cam.read()
+        timestamp = time.time()
         frame = cv2.flip(frame, 1)
+        return frame, timestamp
+
+    def get_frame(self):
+        frame, _ = self.get_timed_frame()
         return frame
 
+    def release(self):
+        """
+        Stops grabbing and closes the device, start() opens it again
+        """
+        self.stop()
+        if self.cam is not None:
+            self.cam.release()
+            self.cam = None
+            self.valid = False
+
+
+def probe_cameras(indices=(0, 1, 2), timeout=2.):
+    """
+    Checks which of the camera indices deliver frames, probing all of them
+    in parallel. Devices that have not answered within timeout seconds are
+    left out (their probing threads finish in the background). Returns the
+    working indices in order.
+    """
+    found = {}
+
+    def probe(index):
+        cam = cv2.VideoCapture(index)
+        try:
+            ok, frame = cam.read()
+            found[index] = ok and frame is not None
+        finally:
+            cam.release()
+
+    threads = []
+    for index in indices:
+        thread = threading.Thread(target=probe, args=(index,))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    deadline = time.time() + timeout
+    for thread in threads:
+        thread.join(max(deadline - time.time(), 0))
+    return [index for index in indices if found.get(index)]
+
+
+class FrameSource(object):
+    """
+    Base of the file-backed and synthetic frame sources, read through the
+    same get_frame / get_timed_frame interface as Camera.
+
+    Subclasses implement _next, returning the next frame and its media time
+    (seconds since the first frame), or (None, None) when exhausted, and
+    _rewind. By default frames are returned as fast as they can be read and
+    timestamped with their media time. With realtime=True frames are paced
+    to their media time and timestamped with time.time(), like a live
+    camera. With loop=True the source restarts at the end, with timestamps
+    continuing to increase. Once exhausted, finished is set and (None, None)
+    is returned.
+    """
+
+    def __init__(self, fps=30., realtime=False, loop=False):
+        self.fps = fps
+        self.realtime = realtime
+        self.loop = loop
+        self.valid = True
+        self.shape = None
+        self.finished = False
+        self.frame_count = 0
+        self.dropped_frames = 0
+        self.profiler = NULL_PROFILER
+        self._clock_start = None
+        self._loop_offset = 0.
+        self._last_time = 0.
+
+    def _next(self):
+        raise NotImplementedError
+
+    def _rewind(self):
+        raise NotImplementedError
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def get_timed_frame(self):
+        if self.finished or not self.valid:
+            return None, None
+        frame, media_time = self._next()
+        if frame is None and self.loop and self.frame_count:
+            self._rewind()
+            self._loop_offset = self._last_time + 1. / self.fps
+            frame, media_time = self._next()
+        if frame is None:
+            self.finished = True
+            return None, None
+        t = self._loop_offset + media_time
+        self._last_time = t
+        self.frame_count += 1
+        self.shape = frame.shape
+        self.profiler.tick("camera")
+
+        if not self.realtime:
+            return frame, t
+        if self._clock_start is None:
+            self._clock_start = time.time() - t
+        wait = self._clock_start + t - time.time()
+        if wait > 0:
+            time.sleep(wait)
+        return frame, self._clock_start + t
+
+    def get_frame(self):
+        frame, _ = self.get_timed_frame()
+        return frame
+
+    def release(self):
+        pass
+
+
+class VideoFile(FrameSource):
+    """
+    Recorded video file.
+
+    Media times are taken from the container, falling back to frame index /
+    frame rate when the backend does not report positions.
+    """
+
+    def __init__(self, path, realtime=False, loop=False):
+        self.path = path
+        self.cam = cv2.VideoCapture(path)
+        super(VideoFile, self).__init__(self.cam.get(cv2.CAP_PROP_FPS) or 30.,
+                                        realtime, loop)
+        self.valid = self.cam.isOpened()
+        self.finished = not self.valid
+        self._index = 0
+
+    def _next(self):
+        ok, frame = self.cam.read()
+        if not ok or frame is None:
+            return None, None
+        media_time = self.cam.get(cv2.CAP_PROP_POS_MSEC) / 1000.
+        if media_time <= 0 and self._index > 0:
+            media_time = self._index / self.fps
+        self._index += 1
+        return frame, media_time
+
+    def _rewind(self):
+        self.cam.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        self._index = 0
+
     def release(self):
         self.cam.release()
+
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".ppm")
+
+
+class ImageSequence(FrameSource):
+    """
+    Directory of image files, read in name order at fps frames per second
+    """
+
+    def __init__(self, directory, fps=30., realtime=False, loop=False):
+        super(ImageSequence, self).__init__(fps, realtime, loop)
+        self.directory = directory
+        self.paths = [os.path.join(directory, name)
+                      for name in sorted(os.listdir(directory))
+                      if name.lower().endswith(IMAGE_EXTENSIONS)]
+        self.valid = len(self.paths) > 0
+        self._index = 0
+
+    def _next(self):
+        while self._index < len(self.paths):
+            frame = cv2.imread(self.paths[self._index])
+            self._index += 1
+            if frame is not None:
+                return frame, (self._index - 1) / float(self.fps)
+        return None, None
+
+    def _rewind(self):
+        self._index = 0
+
+
+class MemmapFrames(FrameSource):
+    """
+    Raw frames mapped from disk, either a .npy file of shape
+    (n, height, width, 3) or a headerless file of uint8 frames of the given
+    (height, width, 3) shape. Frames are copied out of the map, so the file
+    is never written to.
+    """
+
+    def __init__(self, path, shape=None, fps=30., dtype=np.uint8,
+                 realtime=False, loop=False):
+        super(MemmapFrames, self).__init__(fps, realtime, loop)
+        self.path = path
+        if path.lower().endswith(".npy"):
+            self.frames = np.load(path, mmap_mode="r")
+        else:
+            frame_size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            n = os.path.getsize(path) // frame_size
+            self.frames = np.memmap(path, dtype=dtype, mode="r",
+                                    shape=(n,) + tuple(shape))
+        self.valid = len(self.frames) > 0
+        self._index = 0
+
+    def _next(self):
+        if self._index >= len(self.frames):
+            return None, None
+        frame = np.array(self.frames[self._index])
+        self._index += 1
+        return frame, (self._index - 1) / float(self.fps)
+
+    def _rewind(self):
+        self._index = 0
+
+    def release(self):
+        self.frames = self.frames[:0]
+
+
+class SyntheticCamera(FrameSource):
+    """
+    Endless (or n_frames long) stream of a synthetic face pulsing at bpm,
+    see lib.synthetic.SyntheticFace
+    """
+
+    def __init__(self, width=640, height=480, bpm=72., fps=30., noise=1.,
+                 n_frames=None, seed=0, realtime=False, loop=False):
+        super(SyntheticCamera, self).__init__(fps, realtime, loop)
+        self.face = SyntheticFace(width, height, bpm=bpm, noise=noise,
+                                  seed=seed)
+        self.n_frames = n_frames
+        self._index = 0
+
+    def _next(self):
+        if self.n_frames is not None and self._index >= self.n_frames:
+            return None, None
+        t = self._index / float(self.fps)
+        self._index += 1
+        return self.face.render(t), t
+
+    def _rewind(self):
+        self._index = 0
+        self.face.reset()
+
+
+def open_source(spec, realtime=False, loop=False):
+    """
+    Opens a frame source from a description:
+
+    - "synthetic" or "synthetic:BPM" for a SyntheticCamera
+    - a directory of images for an ImageSequence
+    - a .npy file, or "PATH:WIDTHxHEIGHT" for raw uint8 frames, for
+      MemmapFrames
+    - anything else as a VideoFile
+    """
+    if spec == "synthetic" or spec.startswith("synthetic:"):
+        bpm = float(spec.split(":", 1)[1]) if ":" in spec else 72.
+        return SyntheticCamera(bpm=bpm, realtime=realtime, loop=loop)
+    if os.path.isdir(spec):
+        return ImageSequence(spec, realtime=realtime, loop=loop)
+    if spec.lower().endswith(".npy"):
+        return MemmapFrames(spec, realtime=realtime, loop=loop)
+    path, _, size = spec.rpartition(":")
+    if path and "x" in size and os.path.isfile(path):
+        width, height = [int(v) for v in size.lower().split("x")]
+        return MemmapFrames(path, shape=(height, width, 3),
+                            realtime=realtime, loop=loop)
+    return VideoFile(spec, realtime=realtime, loop=loop)
@@ -0,0 +1,300 @@
+import cv2
+import numpy as np
+
+"""
+Face detection & tracking helpers used by the pulse processors
+"""
+
+# Smallest face (pixels) the cascade looks for, and the smallest detection
+# scale at which such a face is still the 20 px window the cascade was
+# trained on
+MIN_FACE_SIZE = 50
+MIN_DETECTION_SCALE = 20. / MIN_FACE_SIZE
+
+
+def gray_region(image, rect=None, scale=1., equalize=False):
+    """
+    Grayscale copy of the (x, y, w, h) region of a BGR or grayscale image,
+    optionally shrunk by scale and histogram-equalized.
+
+    Only the requested region is converted, so callers never pay for a
+    full-frame conversion they do not use.
+    """
+    if rect is not None:
+        x, y, w, h = rect
+        image = image[y:y + h, x:x + w]
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    if scale < 1.:
+        size = (max(int(image.shape[1] * scale), 1),
+                max(int(image.shape[0] * scale), 1))
+        image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+    if equalize:
+        image = cv2.equalizeHist(image)
+    return image
+
+
+def equalization_lut(gray):
+    """
+    Lookup table (for cv2.LUT) that histogram-equalizes gray like
+    cv2.equalizeHist. Applied to another image, e.g. a part of gray, it
+    equalizes that with the histogram of gray.
+    """
+    hist = np.bincount(gray.ravel(), minlength=256)
+    cdf = np.cumsum(hist)
+    lowest = hist[np.flatnonzero(hist)[0]]
+    if cdf[-1] == lowest:
+        return np.arange(256, dtype=np.uint8)
+    lut = np.round((cdf - lowest) * 255. / (cdf[-1] - lowest))
+    return np.clip(lut, 0, 255).astype(np.uint8)
+
+
+def detect_faces(cascade, frame, scale=1., roi=None):
+    """
+    Runs the Haar cascade over a BGR frame and returns the detected face
+    rectangles as a list of (x, y, w, h) arrays.
+
+    If roi (x, y, w, h) is given only that region is searched, and with
+    scale < 1 the search runs on a shrunk copy. Faces smaller than
+    MIN_FACE_SIZE pixels are ignored, and below MIN_DETECTION_SCALE (see
+    detection_scale) also faces smaller than 20 / scale pixels. Rectangles
+    are always returned in full-frame coordinates.
+    """
+    x0, y0 = 0, 0
+    if roi is not None:
+        x0, y0 = roi[:2]
+    gray = gray_region(frame, roi, scale, equalize=True)
+    # 20 px is the window size the cascade was trained on
+    min_size = max(int(MIN_FACE_SIZE * scale), 20)
+    if gray.shape[0] < min_size or gray.shape[1] < min_size:
+        return []
+    detected = cascade.detectMultiScale(gray,
+                                        scaleFactor=1.3,
+                                        minNeighbors=4,
+                                        minSize=(min_size, min_size),
+                                        flags=cv2.CASCADE_SCALE_IMAGE)
+    return [np.array([x0 + int(x / scale), y0 + int(y / scale),
+                      int(w / scale), int(h / scale)])
+            for x, y, w, h in detected]
+
+
+def detection_scale(frame_width, detection_width):
+    """
+    Scale that shrinks frames frame_width pixels wide to about
+    detection_width pixels for detect_faces (1 for None). It never drops
+    below MIN_DETECTION_SCALE, so that faces of MIN_FACE_SIZE pixels are
+    still found: HD frames are shrunk less than detection_width asks for
+    (to 512 rather than 320 pixels at 720p, 768 at 1080p), which trades
+    detection time for range.
+    """
+    if not detection_width:
+        return 1.
+    return max(min(float(detection_width) / frame_width, 1.),
+               MIN_DETECTION_SCALE)
+
+
+def pad_rect(rect, pad, shape):
+    """
+    Grows rect by pad times its size on every side, clipped to an image of
+    the given shape.
+    """
+    x, y, w, h = rect
+    pad_x, pad_y = int(w * pad), int(h * pad)
+    x0, y0 = max(x - pad_x, 0), max(y - pad_y, 0)
+    x1 = min(x + w + pad_x, shape[1])
+    y1 = min(y + h + pad_y, shape[0])
+    return x0, y0, x1 - x0, y1 - y0
+
+
+def rect_overlap(a, b):
+    """
+    Intersection over union of two (x, y, w, h) rectangles
+    """
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    iw = min(ax + aw, bx + bw) - max(ax, bx)
+    ih = min(ay + ah, by + bh) - max(ay, by)
+    if iw <= 0 or ih <= 0:
+        return 0.
+    inter = float(iw * ih)
+    return inter / (aw * ah + bw * bh - inter)
+
+
+def match_rects(old, new, min_overlap=0.3):
+    """
+    Greedy one-to-one matching of two lists of rectangles by overlap.
+    Returns (old index, new index) pairs whose overlap is at least
+    min_overlap.
+    """
+    candidates = sorted(((rect_overlap(a, b), i, j)
+                         for i, a in enumerate(old)
+                         for j, b in enumerate(new)), reverse=True)
+    used_old, used_new = set(), set()
+    matches = []
+    for overlap, i, j in candidates:
+        if overlap < min_overlap:
+            break
+        if i in used_old or j in used_new:
+            continue
+        used_old.add(i)
+        used_new.add(j)
+        matches.append((i, j))
+    return matches
+
+
+def roi_means(frame, rects):
+    """
+    Per-channel means of several (x, y, w, h) regions of a frame, returned
+    as an (n, channels) array.
+
+    A single region is averaged with one cv2.mean pass. For several regions
+    one integral image is built over their bounding box, after which every
+    region costs four lookups per channel regardless of its size.
+    """
+    rects = np.asarray(rects, dtype=np.int64).reshape(-1, 4).copy()
+    channels = frame.shape[2] if frame.ndim == 3 else 1
+    # Clip the regions to the frame, as slicing would
+    height, width = frame.shape[:2]
+    right = np.clip(rects[:, 0] + rects[:, 2], 0, width)
+    bottom = np.clip(rects[:, 1] + rects[:, 3], 0, height)
+    rects[:, 0] = np.clip(rects[:, 0], 0, width)
+    rects[:, 1] = np.clip(rects[:, 1], 0, height)
+    rects[:, 2] = np.maximum(right - rects[:, 0], 0)
+    rects[:, 3] = np.maximum(bottom - rects[:, 1], 0)
+    if len(rects) == 1:
+        x, y, w, h = rects[0]
+        return np.array([cv2.mean(frame[y:y + h, x:x + w])[:channels]])
+
+    x0, y0 = rects[:, 0].min(), rects[:, 1].min()
+    x1 = (rects[:, 0] + rects[:, 2]).max()
+    y1 = (rects[:, 1] + rects[:, 3]).max()
+    integral = cv2.integral(frame[y0:y1, x0:x1], sdepth=cv2.CV_64F)
+    integral = integral.reshape(integral.shape[0], integral.shape[1], -1)
+    left, top = rects[:, 0] - x0, rects[:, 1] - y0
+    right, bottom = left + rects[:, 2], top + rects[:, 3]
+    sums = integral[bottom, right] - integral[top, right] - \
+        integral[bottom, left] + integral[top, left]
+    area = np.maximum(rects[:, 2] * rects[:, 3], 1)
+    return sums / area[:, np.newaxis]
+
+
+def largest_face(detected):
+    """
+    Returns the largest of the detected rectangles, or None
+    """
+    if len(detected) == 0:
+        return None
+    return max(detected, key=lambda a: a[-1] * a[-2])
+
+
+def _subpixel_offset(scores, loc):
+    """
+    Parabolic refinement of the match location, so that tracking on a
+    shrunk image does not quantize the face position.
+    """
+    offsets = []
+    for line, i in ((scores[loc[1], :], loc[0]), (scores[:, loc[0]], loc[1])):
+        if 0 < i < len(line) - 1:
+            a, b, c = line[i - 1], line[i], line[i + 1]
+            denom = a - 2 * b + c
+            offsets.append(0.5 * (a - c) / denom if denom < 0 else 0.)
+        else:
+            offsets.append(0.)
+    return offsets
+
+
+class FaceTracker(object):
+
+    """
+    Detect-then-track face locator.
+
+    The Haar cascade only runs every detect_every frames, or as soon as the
+    tracking confidence drops below min_confidence. In between, the face is
+    followed by normalized template matching of the last detected face inside
+    a padded window around its previous position. Both the template and the
+    search window are shrunk so that the template is about template_width
+    pixels wide, which keeps tracking far cheaper than a full-frame cascade.
+
+    Cascade detections themselves run on a copy shrunk to detection_width
+    pixels (None keeps the native resolution). With roi_pad set, once a face
+    has been seen the cascade first searches only the last face rectangle
+    padded by roi_pad times its size, and falls back to the whole frame if
+    the face is not found there.
+
+    cascade may also be a function returning the classifier, which defers
+    loading it until the first detection.
+    """
+
+    def __init__(self, cascade, detect_every=10, min_confidence=0.6,
+                 search_pad=0.25, template_width=40, detection_width=None,
+                 roi_pad=None):
+        self._cascade = cascade
+        self.detect_every = max(int(detect_every), 1)
+        self.min_confidence = min_confidence
+        self.search_pad = search_pad
+        self.template_width = template_width
+        self.detection_width = detection_width
+        self.roi_pad = roi_pad
+        self.reset()
+
+    @property
+    def cascade(self):
+        if callable(self._cascade):
+            self._cascade = self._cascade()
+        return self._cascade
+
+    def reset(self):
+        self.rect = None
+        self.confidence = 0.
+        self._template = None
+        self._scale = 1.
+        self._frames = 0
+
+    def update(self, frame):
+        """
+        Locates the face in a new BGR frame. Returns the face
+        rectangle as an (x, y, w, h) array, or None if no face was found.
+        """
+        self._frames += 1
+        if self.rect is not None and self._frames < self.detect_every:
+            if self._track(frame):
+                return self.rect
+        return self._detect(frame)
+
+    def _detect(self, frame):
+        self._frames = 0
+        scale = detection_scale(frame.shape[1], self.detection_width)
+        rect = None
+        if self.roi_pad is not None and self.rect is not None:
+            roi = pad_rect(self.rect, self.roi_pad, frame.shape)
+            rect = largest_face(detect_faces(self.cascade, frame, scale, roi))
+        if rect is None:
+            rect = largest_face(detect_faces(self.cascade, frame, scale))
+        if rect is None:
+            self.reset()
+            return None
+        self._scale = min(float(self.template_width) / rect[2], 1.)
+        self._template = gray_region(frame, rect, self._scale)
+        self.rect = np.array(rect)
+        self.confidence = 1.
+        return self.rect
+
+    def _track(self, frame):
+        x, y, w, h = self.rect
+        window_rect = pad_rect(self.rect, self.search_pad, frame.shape)
+        x0, y0 = window_rect[:2]
+        window = gray_region(frame, window_rect, self._scale)
+        th, tw = self._template.shape
+        if window.shape[0] < th or window.shape[1] < tw:
+            return False
+
+        scores = cv2.matchTemplate(window, self._template,
+                                   cv2.TM_CCOEFF_NORMED)
+        _, self.confidence, _, loc = cv2.minMaxLoc(scores)
+        if self.confidence < self.min_confidence:
+            return False
+        dx, dy = _subpixel_offset(scores, loc)
+        self.rect = np.array([x0 + int(round((loc[0] + dx) / self._scale)),
+                              y0 + int(round((loc[1] + dy) / self._scale)),
+                              w, h])
+        return True
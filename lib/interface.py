@@ -64,9 +64,22 @@ def combine(left, right):
 
 def plotXY(data, size=(280, 640), margin=25, name="data", labels=[], skip=[],
            showmax=[], bg=None, label_ndigits=[], showmax_digits=[]):
+    z = render_plotXY(data, size=size, margin=margin, labels=labels,
+                      skip=skip, showmax=showmax, bg=bg,
+                      label_ndigits=label_ndigits,
+                      showmax_digits=showmax_digits)
+    if z is not None:
+        cv2.imshow(name, z)
+
+
+def render_plotXY(data, size=(280, 640), margin=25, labels=[], skip=[],
+                  showmax=[], bg=None, label_ndigits=[], showmax_digits=[]):
+    """Draws the plots of plotXY into an image without displaying it.
+    Returns None if there is not enough data to plot.
+    """
     for x, y in data:
         if len(x) < 2 or len(y) < 2:
-            return
+            return None
 
     n_plots = len(data)
     w = float(size[1])
@@ -130,4 +143,4 @@ def plotXY(data, size=(280, 640), margin=25, name="data", labels=[], skip=[],
     for p in P:
         for i in xrange(len(p) - 1):
             cv2.line(z, tuple(p[i]), tuple(p[i + 1]), (255, 255, 255), 1)
-    cv2.imshow(name, z)
+    return z
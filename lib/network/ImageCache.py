@@ -0,0 +1,90 @@
+import json
+import os
+import threading
+from multiprocessing.pool import ThreadPool
+
+from constants import constants
+from lib.network.NetworkHelper import NetworkHelper
+
+
+class ImageCache(object):
+    """
+    Maps image names to their ids on the API host.
+
+    Known ids are looked up in a dict and persisted to path, keyed by the API
+    host, so they survive restarts. Names that are not known yet are
+    registered with NetworkHelper.add_image concurrently, by a small pool of
+    worker threads. The HTTP status of the last failed registration of a
+    name (None if there was no response) is kept in errors.
+    """
+
+    def __init__(self, path, workers=constants.IMAGE_LOOKUP_WORKERS):
+        self.path = path
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._pool = None
+        self._hosts = {}
+        self.errors = {}
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self._hosts = json.load(f)
+            except ValueError:
+                print("Ignoring corrupt image cache {0}".format(path))
+        self.ids = self._hosts.setdefault(constants.BASE_URL, {})
+
+    def resolve(self, names):
+        """
+        Returns a dict with the ids of the given image names. Names that
+        could not be registered are left out.
+        """
+        names = set(names)
+        missing = [name for name in names if name not in self.ids]
+        if missing:
+            if self._pool is None:
+                self._pool = ThreadPool(self.workers)
+            found = False
+            for name, (result, status) in zip(missing,
+                                              self._pool.map(self._fetch,
+                                                             missing)):
+                if result is not None:
+                    self.ids[name] = result
+                    self.errors.pop(name, None)
+                    found = True
+                else:
+                    self.errors[name] = status
+            if found:
+                self.save()
+        return dict((name, self.ids[name]) for name in names
+                    if name in self.ids)
+
+    @staticmethod
+    def _fetch(name):
+        """
+        Returns the id of name and None, or None and the failure status
+        """
+        success, image = NetworkHelper.add_image({'name': name})
+        if not success:
+            return None, image
+        if isinstance(image, dict) and image.get('id') is not None:
+            return image['id'], None
+        # Answered without an id
+        return None, constants.STATUS_OK
+
+    def save(self):
+        with self._lock:
+            tmp = self.path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(self._hosts, f)
+            # Replace in one step, so a crash never leaves half a file
+            # (Windows cannot rename over an existing file)
+            try:
+                os.rename(tmp, self.path)
+            except OSError:
+                os.remove(self.path)
+                os.rename(tmp, self.path)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
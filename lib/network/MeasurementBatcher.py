@@ -0,0 +1,109 @@
+import json
+import time
+
+from constants import constants
+from lib.network.NetworkHelper import NetworkHelper
+
+
+class MeasurementBatcher(object):
+    """
+    Collects bpm estimates into upload batches.
+
+    Estimates are summarized per interval seconds and image into one record
+    holding their mean ("value"), "min", "max" and count "n". A batch is due
+    once it holds max_count records, about max_bytes of JSON, or its oldest
+    estimate is max_latency seconds old.
+
+    When the uploader falls behind (backpressure), adapt() doubles the
+    interval, up to max_interval, so that fewer and coarser records are
+    queued. Once the backlog has cleared it halves it again.
+    """
+
+    def __init__(self, max_count=50, max_bytes=constants.BATCH_MAX_BYTES,
+                 max_latency=constants.BATCH_MAX_LATENCY,
+                 interval=constants.BATCH_INTERVAL,
+                 max_interval=constants.BATCH_MAX_INTERVAL):
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.max_latency = max_latency
+        self.base_interval = interval
+        self.interval = interval
+        self.max_interval = max_interval
+        self.records = []
+        self.size = 0
+        self._open = None
+
+    def __len__(self):
+        return len(self.records) + (self._open is not None)
+
+    def add(self, value, image, timestamp=None):
+        """
+        Adds one estimate, shown while image was displayed
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        current = self._open
+        if current is not None and (current["image"] != image or
+                                    timestamp - current["timestamp"] >= self.interval):
+            self._close()
+            current = None
+        if current is None:
+            self._open = {"timestamp": timestamp, "image": image, "sum": 0.,
+                          "min": value, "max": value, "n": 0}
+            current = self._open
+        current["sum"] += value
+        current["min"] = min(current["min"], value)
+        current["max"] = max(current["max"], value)
+        current["n"] += 1
+
+    def _close(self):
+        current = self._open
+        self._open = None
+        record = {"value": current["sum"] / current["n"],
+                  "min": current["min"],
+                  "max": current["max"],
+                  "n": current["n"],
+                  "time": NetworkHelper.get_formatted_time(current["timestamp"]),
+                  "timestamp": current["timestamp"],
+                  "image": current["image"]}
+        self.records.append(record)
+        self.size += len(json.dumps(record))
+
+    def due(self, now=None):
+        """
+        True when the collected records should be uploaded
+        """
+        if not len(self):
+            return False
+        if now is None:
+            now = time.time()
+        oldest = self.records[0] if self.records else self._open
+        if now - oldest["timestamp"] >= self.max_latency:
+            return True
+        return len(self.records) >= self.max_count or self.size >= self.max_bytes
+
+    def take(self):
+        """
+        Returns and removes all records, including the open interval
+        """
+        if self._open is not None:
+            self._close()
+        records, self.records, self.size = self.records, [], 0
+        return records
+
+    def put_back(self, records):
+        """
+        Returns records that could not be queued, ahead of newer ones
+        """
+        self.records = list(records) + self.records
+        self.size += sum(len(json.dumps(record)) for record in records)
+
+    def adapt(self, backlog, limit):
+        """
+        Coarsens the records while the uploader has more than half of limit
+        batches waiting, and refines them again once it has caught up
+        """
+        if backlog > limit // 2:
+            self.interval = min(2 * self.interval, self.max_interval)
+        elif backlog == 0:
+            self.interval = max(self.interval / 2., self.base_interval)
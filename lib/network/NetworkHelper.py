@@ -1,15 +1,79 @@
 import json
+import threading
 import time
 
 import requests
+from requests.adapters import HTTPAdapter
 
 from constants import constants
+from lib.network import RecordCodec
+from lib.profiling import NULL_PROFILER
 
 
 class NetworkHelper:
+    # One keep-alive session shared by all requests, created on first use
+    _session = None
+    _session_lock = threading.Lock()
+    # Whether the server accepts bulk records in the binary encoding, None
+    # until it was asked
+    _binary_records = None
+    # Times every request as the "request" stage
+    profiler = NULL_PROFILER
+
     def __init__(self):
         pass
 
+    @staticmethod
+    def session():
+        """
+        Returns the shared requests.Session, whose pooled connections to the
+        API host are reused across requests and threads
+        """
+        with NetworkHelper._session_lock:
+            if NetworkHelper._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1,
+                                      pool_maxsize=constants.CONNECTION_POOL_SIZE)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                NetworkHelper._session = session
+            return NetworkHelper._session
+
+    @staticmethod
+    def post(url, **kwargs):
+        """
+        POST through the shared session, with the default request timeout
+        """
+        kwargs.setdefault("timeout", constants.REQUEST_TIMEOUT)
+        with NetworkHelper.profiler.stage("request"):
+            return NetworkHelper.session().post(url=url, **kwargs)
+
+    @staticmethod
+    def binary_records_supported():
+        """
+        Only with RECORD_ENCODING "binary": asks the server once whether
+        add_record/bulk accepts the RecordCodec encoding. Servers advertise
+        it by listing RecordCodec.MEDIA_TYPE in the Accept-Post header of
+        their OPTIONS response.
+        """
+        if constants.RECORD_ENCODING != "binary":
+            return False
+        if NetworkHelper._binary_records is None:
+            url = "{0}{1}".format(constants.BASE_URL, "add_record/bulk")
+            try:
+                with NetworkHelper.profiler.stage("request"):
+                    response = NetworkHelper.session().options(
+                        url, timeout=constants.REQUEST_TIMEOUT)
+            except Exception as err:
+                # Asked again with the next upload
+                print(err.message)
+                return False
+            media_types = [media_type.split(";")[0].strip() for media_type
+                           in response.headers.get("Accept-Post", "").split(",")]
+            NetworkHelper._binary_records = 200 <= response.status_code < 300 and \
+                RecordCodec.MEDIA_TYPE in media_types
+        return NetworkHelper._binary_records
+
     @staticmethod
     def get_formatted_time(time_seconds):
         FMT = "%Y-%m-%d %H:%M:%S"
@@ -27,7 +91,7 @@ class NetworkHelper:
         }
 
         try:
-            response = requests.post(url=url, data=body)
+            response = NetworkHelper.post(url, data=body)
             data = None
 
             if response.status_code == constants.STATUS_OK:
@@ -43,25 +107,71 @@ class NetworkHelper:
 
     @staticmethod
     def add_record_bulk(session_id, records):
+        """
+        Uploads records, in the compact binary encoding if it is enabled and
+        the server advertises it, as JSON otherwise. A failed upload returns
+        the HTTP status code, or None if there was no response.
+        """
+        if RecordCodec.can_encode(records) and NetworkHelper.binary_records_supported():
+            is_success, status = NetworkHelper.add_record_bulk_binary(session_id, records)
+            if is_success:
+                return True, None
+            if status is None:
+                # Not reachable, JSON would not get through either
+                return False, None
+            # Whatever the server did not like, this batch goes as JSON
+
         url = "{0}{1}".format(constants.BASE_URL, "add_record/bulk")
         body = {
             "measurement_session_id": session_id,
-            "records": records,
+            # The numeric timestamp only goes into the binary encoding
+            "records": [dict((k, v) for k, v in record.items() if k != "timestamp")
+                        for record in records],
             "app_secret": constants.APP_SECRET
         }
         try:
-            response = requests.post(url=url, json=body)
+            response = NetworkHelper.post(url, json=body)
 
             if response.status_code == constants.STATUS_OK:
                 return True, None
+            # The status tells the uploader whether a retry can help
+            return False, response.status_code
+
+        except Exception as err:
+            print(err.message)
             return False, None
 
+    @staticmethod
+    def add_record_bulk_binary(session_id, records):
+        """
+        Uploads records in the RecordCodec encoding. Returns (success,
+        status), status being the HTTP status code or None if the request
+        failed.
+        """
+        url = "{0}{1}".format(constants.BASE_URL, "add_record/bulk")
+        headers = {
+            "Content-Type": RecordCodec.MEDIA_TYPE,
+            "Content-Encoding": "gzip"
+        }
+        params = {
+            "measurement_session_id": session_id,
+            "app_secret": constants.APP_SECRET
+        }
+        try:
+            response = NetworkHelper.post(url, data=RecordCodec.encode_records(records),
+                                          headers=headers, params=params)
+            return 200 <= response.status_code < 300, response.status_code
+
         except Exception as err:
             print(err.message)
             return False, None
 
     @staticmethod
     def add_image(image):
+        """
+        Registers an image name. A failed request returns the HTTP status
+        code, or None if there was no response.
+        """
         url = "{0}{1}".format(constants.BASE_URL, "add_image")
         body = {
             "name": image['name'],
@@ -71,13 +181,16 @@ class NetworkHelper:
             body['location'] = image['location']
 
         try:
-            response = requests.post(url=url, data=body)
-            data = None
+            response = NetworkHelper.post(url, data=body)
 
             if response.status_code == constants.STATUS_OK:
-                data = json.loads(response.text)
-                return True, data
-            return False, data
+                try:
+                    data = json.loads(response.text)
+                    return True, data
+                except ValueError:
+                    pass
+            # Answered, but not registered
+            return False, response.status_code
 
         except Exception as err:
             error_msg = "Connection refused" if "Connection refused" in str(err.message) \
@@ -96,7 +209,7 @@ class NetworkHelper:
         }
 
         try:
-            response = requests.post(url=url, data=body)
+            response = NetworkHelper.post(url, data=body)
 
             if response.status_code == constants.STATUS_OK:
                 data = json.loads(response.text)
@@ -0,0 +1,149 @@
+import json
+import os
+import threading
+import time
+
+
+class Outbox(object):
+    """
+    Durable, append-only log of measurement batches awaiting upload.
+
+    Every batch is written (and fsynced) as one JSON line to the current
+    segment file before it is sent, and every acknowledged upload appends an
+    {"ack": id} line. Segments hold up to segment_size batches; once all
+    batches of a segment are acknowledged the segment is deleted.
+    Batches that were never acknowledged, e.g. because the host was down
+    when the application closed, are returned by pending() on the next
+    start. Batches that will never be uploaded are moved to the dead-letter
+    file by dead_letter(), where they are kept but not sent again.
+    """
+
+    PREFIX = "segment-"
+    SUFFIX = ".jsonl"
+    DEAD_LETTER = "dead-letter.jsonl"
+
+    def __init__(self, directory, segment_size=100):
+        self.directory = directory
+        self.segment_size = segment_size
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self._lock = threading.Lock()
+        # segment path -> ids of its batches, and the ids not yet acked
+        self._segments = {}
+        self._pending = {}
+        self._next_id = 1
+        self._current = None
+        self._load()
+
+    def _segment_paths(self):
+        names = [name for name in os.listdir(self.directory)
+                 if name.startswith(self.PREFIX) and name.endswith(self.SUFFIX)]
+        # Segments are named after their first batch id
+        names.sort(key=lambda name: int(name[len(self.PREFIX):-len(self.SUFFIX)]))
+        return [os.path.join(self.directory, name) for name in names]
+
+    def _load(self):
+        acked = set()
+        for path in self._segment_paths():
+            ids = []
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Line cut short by a crash while it was written
+                        continue
+                    if "ack" in entry:
+                        acked.add(entry["ack"])
+                    else:
+                        ids.append(entry["id"])
+                        # Entries of older versions have no creation time
+                        self._pending[entry["id"]] = (entry["session_id"],
+                                                      entry["records"],
+                                                      entry.get("created", time.time()))
+                        self._next_id = max(self._next_id, entry["id"] + 1)
+            self._segments[path] = ids
+        for batch_id in acked:
+            self._pending.pop(batch_id, None)
+        self._compact()
+
+    def _segment(self):
+        """
+        Returns the segment new entries are appended to, starting a new one
+        when it is full
+        """
+        if self._current is None or \
+                len(self._segments[self._current]) >= self.segment_size:
+            self._current = os.path.join(
+                self.directory,
+                "{0}{1}{2}".format(self.PREFIX, self._next_id, self.SUFFIX))
+            self._segments[self._current] = []
+        return self._current
+
+    def _write(self, path, entry):
+        with open(path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def append(self, session_id, records):
+        """
+        Persists a batch and returns its id
+        """
+        with self._lock:
+            path = self._segment()
+            batch_id = self._next_id
+            self._next_id += 1
+            created = time.time()
+            self._write(path, {"id": batch_id, "session_id": session_id,
+                               "records": records, "created": created})
+            self._segments[path].append(batch_id)
+            self._pending[batch_id] = (session_id, records, created)
+            return batch_id
+
+    def ack(self, batch_ids):
+        """
+        Marks batches as uploaded and deletes segments that are done
+        """
+        with self._lock:
+            for batch_id in batch_ids:
+                if self._pending.pop(batch_id, None) is None:
+                    continue
+                for path, ids in self._segments.items():
+                    if batch_id in ids:
+                        self._write(path, {"ack": batch_id})
+                        break
+            self._compact()
+
+    def dead_letter(self, batch_ids, reason):
+        """
+        Moves batches to the dead-letter file, with the reason they were
+        given up on
+        """
+        with self._lock:
+            path = os.path.join(self.directory, self.DEAD_LETTER)
+            for batch_id in batch_ids:
+                if batch_id not in self._pending:
+                    continue
+                session_id, records, created = self._pending[batch_id]
+                self._write(path, {"id": batch_id, "session_id": session_id,
+                                   "records": records, "created": created,
+                                   "reason": reason})
+        self.ack(batch_ids)
+
+    def pending(self):
+        """
+        Returns the unacknowledged (id, session_id, records, created) batches
+        in the order they were appended
+        """
+        with self._lock:
+            return [(batch_id,) + self._pending[batch_id]
+                    for batch_id in sorted(self._pending)]
+
+    def _compact(self):
+        for path, ids in list(self._segments.items()):
+            if not any(batch_id in self._pending for batch_id in ids):
+                os.remove(path)
+                del self._segments[path]
+                if path == self._current:
+                    self._current = None
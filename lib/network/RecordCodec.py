@@ -0,0 +1,92 @@
+import calendar
+import struct
+import time
+import zlib
+
+import numpy as np
+
+"""
+Compact columnar encoding of measurement records for bulk uploads.
+
+A payload is the magic bytes "PLS2" and the record count (uint32), followed
+by six columns: epoch timestamps in milliseconds (int64), mean, minimum and
+maximum bpm (float32), the number of estimates summarized (uint32) and image
+ids (uint32, NO_IMAGE if a record has none), all little-endian. Records
+without a summary count as one estimate. The whole payload is
+gzip-compressed. Compared with the JSON body this is about 28 bytes per
+record before compression, and the server can read each column as one
+array.
+"""
+
+MEDIA_TYPE = "application/vnd.get-pulse.records"
+MAGIC = b"PLS2"
+NO_IMAGE = 0xFFFFFFFF
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def record_timestamp(record):
+    """
+    Epoch time of a record in seconds, from its "timestamp" or, failing
+    that, its formatted "time" (UTC)
+    """
+    if record.get("timestamp") is not None:
+        return float(record["timestamp"])
+    return calendar.timegm(time.strptime(record["time"], TIME_FORMAT))
+
+
+def can_encode(records):
+    """
+    Only records whose images were resolved to ids can be encoded
+    """
+    return all(record.get("image") is None or
+               isinstance(record["image"], (int, long))
+               for record in records)
+
+
+def encode_records(records):
+    n = len(records)
+    times = np.array([round(1000 * record_timestamp(record))
+                      for record in records], dtype="<i8")
+    values = np.array([record["value"] for record in records], dtype="<f4")
+    minima = np.array([record.get("min", record["value"])
+                       for record in records], dtype="<f4")
+    maxima = np.array([record.get("max", record["value"])
+                       for record in records], dtype="<f4")
+    counts = np.array([record.get("n", 1) for record in records], dtype="<u4")
+    images = np.array([NO_IMAGE if record.get("image") is None
+                       else record["image"] for record in records],
+                      dtype="<u4")
+    payload = MAGIC + struct.pack("<I", n) + times.tobytes() + \
+        values.tobytes() + minima.tobytes() + maxima.tobytes() + \
+        counts.tobytes() + images.tobytes()
+    # wbits 31 writes a gzip container
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    return compressor.compress(payload) + compressor.flush()
+
+
+def decode_records(data):
+    """
+    Inverse of encode_records, returns records with "timestamp" (seconds),
+    "value", "min", "max", "n" and "image" (None if there was none)
+    """
+    payload = zlib.decompress(data, 31)
+    if payload[:4] != MAGIC:
+        raise ValueError("Not a record payload")
+    n, = struct.unpack("<I", payload[4:8])
+    offset = 8
+    times = np.frombuffer(payload, "<i8", n, offset)
+    offset += 8 * n
+    values = np.frombuffer(payload, "<f4", n, offset)
+    offset += 4 * n
+    minima = np.frombuffer(payload, "<f4", n, offset)
+    offset += 4 * n
+    maxima = np.frombuffer(payload, "<f4", n, offset)
+    offset += 4 * n
+    counts = np.frombuffer(payload, "<u4", n, offset)
+    offset += 4 * n
+    images = np.frombuffer(payload, "<u4", n, offset)
+    return [{"timestamp": t / 1000., "value": float(v), "min": float(low),
+             "max": float(high), "n": int(count),
+             "image": None if image == NO_IMAGE else int(image)}
+            for t, v, low, high, count, image in zip(times, values, minima,
+                                                     maxima, counts, images)]
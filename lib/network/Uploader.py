@@ -0,0 +1,228 @@
+import itertools
+import threading
+import time
+from collections import deque
+from Queue import Empty, Full, Queue
+
+from constants import constants
+from lib.profiling import NULL_PROFILER
+
+
+class Uploader(object):
+    """
+    Uploads measurement records from a single background thread.
+
+    Batches are submitted to a bounded queue. When the queue is full, submit
+    returns False rather than blocking the caller, unless there is an outbox
+    (see below). The worker takes
+    everything queued at once and coalesces consecutive batches of the same
+    measurement session into requests of up to batch_size records, each
+    sent by send(session_id, records). send returns a (success, data) pair
+    like the NetworkHelper methods, data being the HTTP status code of a
+    failed request (None if there was no response).
+
+    Requests that got no response, or a 5xx, 408 or 429 one, are retried in
+    order after a delay that doubles from retry_delay up to max_retry_delay.
+    Batches the server refuses (any other 4xx), that still fail after
+    max_attempts answered requests or that are older than max_age seconds
+    are given up on, so that they do not hold up the batches after them.
+    Coalesced batches are sent one by one to find the refused one.
+
+    With an outbox (see Outbox) every batch is persisted before it is
+    queued and acknowledged once uploaded, batches left over from an
+    earlier run are sent first, and batches that were given up on are moved
+    to its dead-letter file. Batches that do not fit into the queue are kept
+    in the outbox and sent after the queued ones.
+
+    With a profiler (see lib.profiling) every send is timed as the "upload"
+    stage, and the uploaded records, failed requests, retries and dropped
+    batches are counted.
+    """
+
+    _STOP = object()
+
+    def __init__(self, send, outbox=None,
+                 queue_size=constants.UPLOAD_QUEUE_SIZE,
+                 batch_size=constants.UPLOAD_BATCH_SIZE,
+                 retry_delay=constants.RETRY_DELAY,
+                 max_retry_delay=constants.MAX_RETRY_DELAY,
+                 max_attempts=constants.MAX_UPLOAD_ATTEMPTS,
+                 max_age=constants.MAX_UPLOAD_AGE, profiler=None):
+        self.send = send
+        self.outbox = outbox
+        self.batch_size = batch_size
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.max_attempts = max_attempts
+        self.max_age = max_age
+        self.profiler = profiler or NULL_PROFILER
+        self.queue = Queue(maxsize=queue_size)
+        self.sent_records = 0
+        self.failed_requests = 0
+        self.dropped_batches = 0
+        self._ids = itertools.count(1)
+        # (batch id, session id, records, creation time) not uploaded yet,
+        # oldest first
+        self._pending = []
+        # Answered failed requests of the first pending batch, and whether
+        # batches are sent one by one until a failing one is given up on
+        self._attempts = 0
+        self._single = False
+        # Outbox batches that did not fit into the queue
+        self._overflow = deque()
+        self._stopping = threading.Event()
+        if outbox is not None:
+            self._pending = outbox.pending()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, session_id, records, block=False, timeout=None):
+        """
+        Queues records for upload. Returns False if the queue stayed full and
+        there is no outbox to keep them in.
+        """
+        records = list(records)
+        if self.outbox is not None:
+            batch_id = self.outbox.append(session_id, records)
+        else:
+            batch_id = next(self._ids)
+        batch = (batch_id, session_id, records, time.time())
+        try:
+            self.queue.put(batch, block, timeout)
+            return True
+        except Full:
+            if self.outbox is None:
+                return False
+            # Already persisted, the worker picks it up after the queue
+            self._overflow.append(batch)
+            return True
+
+    def pending(self):
+        """
+        Number of batches not uploaded yet, queued or waiting for a retry
+        """
+        return self.queue.qsize() + len(self._overflow) + len(self._pending)
+
+    def close(self, timeout=None):
+        """
+        Uploads what is still queued, then stops the worker, waiting at most
+        timeout seconds. Batches that could not be uploaded stay in the
+        outbox.
+        """
+        self._stopping.set()
+        try:
+            # Wakes the worker if it is idle, a full queue keeps it busy
+            # anyway
+            self.queue.put_nowait(self._STOP)
+        except Full:
+            pass
+        self._thread.join(timeout)
+
+    def _run(self):
+        stop = False
+        delay = 0.
+        while True:
+            # Checked first, everything submitted before close() is queued
+            # by then
+            stopping = self._stopping.is_set()
+            # Wait for new batches, or until the next retry is due
+            try:
+                timeout = delay if self._pending else None
+                items = [self.queue.get(timeout=timeout)]
+            except Empty:
+                items = []
+            # Everything that piled up while the last request was running
+            # goes out together
+            while True:
+                try:
+                    items.append(self.queue.get_nowait())
+                except Empty:
+                    break
+            stop = stop or stopping or self._STOP in items
+            self._pending.extend(item for item in items
+                                 if item is not self._STOP)
+            if self._overflow:
+                while self._overflow:
+                    self._pending.append(self._overflow.popleft())
+                # Outbox ids follow the order of submission
+                self._pending.sort(key=lambda batch: batch[0])
+
+            if self._send_pending():
+                delay = 0.
+            else:
+                delay = min(max(2 * delay, self.retry_delay),
+                            self.max_retry_delay)
+            if stop and (not self._pending or delay > 0):
+                return
+
+    def _send_pending(self):
+        """
+        Sends the pending batches in order. Returns False at the first failed
+        request that is worth retrying, leaving it and everything after it
+        pending.
+        """
+        while self._pending:
+            if time.time() - self._pending[0][3] > self.max_age:
+                self._drop("older than {0} s".format(self.max_age))
+                continue
+            session_id = self._pending[0][1]
+            n, size = 0, 0
+            for _, batch_session, records, _ in self._pending:
+                if batch_session != session_id or \
+                        (n and (self._single or size + len(records) > self.batch_size)):
+                    break
+                n += 1
+                size += len(records)
+            batches = self._pending[:n]
+            records = [record for _, _, batch, _ in batches for record in batch]
+            try:
+                with self.profiler.stage("upload"):
+                    success, status = self.send(session_id, records)
+            except Exception as err:
+                print("Upload failed: {0}".format(err))
+                success, status = False, None
+            if success:
+                self.sent_records += len(records)
+                self.profiler.count("uploaded_records", len(records))
+                self._attempts = 0
+                del self._pending[:n]
+                if self.outbox is not None:
+                    self.outbox.ack([batch_id for batch_id, _, _, _ in batches])
+                continue
+
+            self.failed_requests += 1
+            self.profiler.count("failed_uploads")
+            if status is not None and 400 <= status < 500 and \
+                    status not in (408, 429):
+                if n > 1:
+                    # One of the coalesced batches is refused
+                    self._single = True
+                    continue
+                self._drop("refused with status {0}".format(status))
+                continue
+            if status is not None:
+                self._attempts += 1
+                if self._attempts >= self.max_attempts and n > 1:
+                    self._single = True
+                    self._attempts = 0
+                elif self._attempts >= self.max_attempts:
+                    self._drop("failed {0} times, last with status {1}".format(
+                        self._attempts, status))
+                    continue
+            self.profiler.count("upload_retries")
+            return False
+        return True
+
+    def _drop(self, reason):
+        """
+        Gives up on the first pending batch
+        """
+        batch_id = self._pending.pop(0)[0]
+        self._attempts = 0
+        self._single = False
+        self.dropped_batches += 1
+        self.profiler.count("dropped_batches")
+        print("Upload of batch {0} given up, {1}".format(batch_id, reason))
+        if self.outbox is not None:
+            self.outbox.dead_letter([batch_id], reason)
@@ -5,6 +5,13 @@ import sys
 from datetime import datetime
 import time
 
+from lib.faceProcess import FaceTracker, detect_faces, detection_scale, \
+    equalization_lut, gray_region, match_rects, pad_rect, roi_means
+from lib.profiling import NULL_PROFILER
+from lib.signalProcess import EstimateScheduler, RingBuffer, SlidingDFT, \
+    UniformResampler, band_spectrum, peak_confidence, peak_offset, \
+    resample_uniform, zoom_peak
+
 
 def resource_path(relative_path):
     """ Get absolute path to resource, works for dev and for PyInstaller """
@@ -17,16 +24,37 @@ def resource_path(relative_path):
     return os.path.join(base_path, relative_path)
 
 
+def load_face_cascade():
+    dpath = resource_path("haarcascade_frontalface_alt.xml")
+    if not os.path.exists(dpath):
+        print "Cascade file not present!"
+    return cv2.CascadeClassifier(dpath)
+
+
+def subface_coord(face_rect, fh_x, fh_y, fh_w, fh_h):
+    x, y, w, h = face_rect
+    return [int(x + w * fh_x - (w * fh_w / 2.0)),
+            int(y + h * fh_y - (h * fh_h / 2.0)),
+            int(w * fh_w),
+            int(h * fh_h)]
+
+
 class findFaceGetPulse(object):
     def __init__(self, bpm_limits=[], data_spike_limit=250,
-                 face_detector_smoothness=10):
+                 face_detector_smoothness=10, estimator="fft",
+                 estimate_rate=None, estimate_every=1, detect_every=1,
+                 detection_width=None, detection_roi_pad=None,
+                 equalize_overlay=True, channel=None, draw_overlay=True,
+                 peak_refinement=None, buffer_size=250,
+                 adaptive_window=False, min_window=96, min_confidence=0.,
+                 profiler=None):
 
         self.frame_in = np.zeros((10, 10))
         self.frame_out = np.zeros((10, 10))
         self.fps = 0
-        self.buffer_size = 250
-        self.data_buffer = []
-        self.times = []
+        self.buffer_size = buffer_size
+        self.data_buffer = RingBuffer(self.buffer_size)
+        self.times = self.data_buffer.times
         self.ttimes = []
         self.samples = []
         self.freqs = []
@@ -36,10 +64,61 @@ class findFaceGetPulse(object):
         self.bpms = []
         self.bpm = 0
 
-        dpath = resource_path("haarcascade_frontalface_alt.xml")
-        if not os.path.exists(dpath):
-            print "Cascade file not present!"
-        self.face_cascade = cv2.CascadeClassifier(dpath)
+        # "fft" recomputes the whole spectrum of the evenly resampled buffer,
+        # "sliding" updates only the heart-rate band bins as samples arrive
+        self.estimator = estimator
+        self.sliding_dft = None
+        if estimator == "sliding":
+            self.sliding_dft = SlidingDFT(self.buffer_size)
+        # The spectral peak is picked at bin resolution (about 7 bpm for
+        # 250 samples at 30 fps); "parabolic" interpolates it from its
+        # neighbours and "zoom" evaluates a fine spectrum around it, which
+        # allows shorter buffers for the same resolution
+        self.peak_refinement = peak_refinement
+        # Estimates whose peak_confidence is below min_confidence are shown
+        # but not counted. With adaptive_window only the first estimate after
+        # a face was found has to reach min_confidence: the fft estimator
+        # makes it after only min_window samples, waiting longer while
+        # estimates stay below min_confidence. Later estimates are all
+        # counted and use all buffered samples, up to buffer_size, as
+        # without adaptive_window.
+        self.adaptive_window = adaptive_window
+        self.min_window = min(min_window, self.buffer_size)
+        self.min_confidence = min_confidence
+        self.window = self.buffer_size
+        self.confidence = 0.
+        self.reliable = False
+        self.reset_window()
+        # Evenly spaced copy of the samples, extended incrementally
+        self.resampler = UniformResampler()
+        self.uniform_buffer = RingBuffer(self.buffer_size)
+        # Samples are collected on every frame, the spectral estimate is only
+        # refreshed every estimate_every samples and at most estimate_rate
+        # times per second
+        self.scheduler = EstimateScheduler(rate=estimate_rate,
+                                           every=estimate_every)
+        self.alpha = None
+        # Histogram-equalize the grayscale blended into the forehead overlay
+        self.equalize_overlay = equalize_overlay
+        # Color channel sampled from the forehead (0, 1, 2 for B, G, R),
+        # None averages all three
+        self.channel = channel
+        # Headless processing can skip all drawing into frame_out
+        self.draw_overlay = draw_overlay
+        # Times the detect, sample, estimate and overlay stages of run
+        self.profiler = profiler or NULL_PROFILER
+
+        # The cascade is only loaded for the first detection
+        self._face_cascade = None
+        # With detect_every > 1 the cascade only runs every detect_every
+        # frames, the face is tracked by template matching in between.
+        # detection_width shrinks the frame before running the cascade (see
+        # detection_scale) and detection_roi_pad limits it to the area
+        # around the last face.
+        self.face_tracker = FaceTracker(lambda: self.face_cascade,
+                                        detect_every=detect_every,
+                                        detection_width=detection_width,
+                                        roi_pad=detection_roi_pad)
 
         self.face_rect = [1, 1, 2, 2]
         self.last_center = np.array([0, 0])
@@ -54,6 +133,12 @@ class findFaceGetPulse(object):
 
         self.time_gap = None
 
+    @property
+    def face_cascade(self):
+        if self._face_cascade is None:
+            self._face_cascade = load_face_cascade()
+        return self._face_cascade
+
     def find_faces_toggle(self, data):
         self.find_faces = not self.find_faces
         self.start_time = self.get_current_time()
@@ -67,6 +152,18 @@ class findFaceGetPulse(object):
 
         return self.find_faces
 
+    def start_measuring(self, record_length=0):
+        """
+        Locks the face location and starts collecting forehead samples
+        """
+        self.find_faces = False
+        self.start_time = self.get_current_time()
+        self.end_time = record_length + self.start_time
+        self.heart_rates = []
+
+    def face_found(self):
+        return set(self.face_rect) != set([1, 1, 2, 2])
+
     def get_faces(self):
         return
 
@@ -83,21 +180,29 @@ class findFaceGetPulse(object):
         cv2.rectangle(self.frame_out, (x, y), (x + w, y + h), col, 1)
 
     def get_subface_coord(self, fh_x, fh_y, fh_w, fh_h):
-        x, y, w, h = self.face_rect
-        return [int(x + w * fh_x - (w * fh_w / 2.0)),
-                int(y + h * fh_y - (h * fh_h / 2.0)),
-                int(w * fh_w),
-                int(h * fh_h)]
+        return subface_coord(self.face_rect, fh_x, fh_y, fh_w, fh_h)
+
+    def get_subface_channel_means(self, coord):
+        """
+        Per-channel (B, G, R) means of the subface region, in a single pass
+        """
+        return roi_means(self.frame_in, [coord])[0]
 
     def get_subface_means(self, coord):
-        x, y, w, h = coord
-        subframe = self.frame_in[y:y + h, x:x + w, :]
-        v1 = np.mean(subframe[:, :, 0])
-        v2 = np.mean(subframe[:, :, 1])
-        v3 = np.mean(subframe[:, :, 2])
+        v1, v2, v3 = self.get_subface_channel_means(coord)
 
         return (v1 + v2 + v3) / 3.
 
+    def get_subface_sample(self, coord):
+        """
+        Signal value sampled from the subface region: the mean over all
+        channels, or only the selected channel (1 is green)
+        """
+        means = self.get_subface_channel_means(coord)
+        if self.channel is None:
+            return means.mean()
+        return means[self.channel]
+
     def train(self):
         self.trained = not self.trained
         return self.trained
@@ -127,129 +232,220 @@ class findFaceGetPulse(object):
     #     pylab.savefig("data_fft.png")
     #     quit()
 
-    def run(self, cam):
+    def run(self, cam, timestamp=None):
         """
-        Function used to process single image received from camera
+        Function used to process single image received from camera.
+        timestamp (as returned by time.time()) is when the frame was
+        grabbed; it defaults to now.
         """
-        self.times.append(time.time() - self.t0)
+        if timestamp is None:
+            timestamp = time.time()
+        timestamp = timestamp - self.t0
         self.frame_out = self.frame_in
-        self.gray = cv2.equalizeHist(cv2.cvtColor(self.frame_in,
-                                                  cv2.COLOR_BGR2GRAY))
         col = (100, 255, 100)
 
         # if not measuring
         if self.find_faces:
-            self.detect_face()
+            with self.profiler.stage("detect"):
+                self.detect_face()
             return
-        elif set(self.face_rect) == set([1, 1, 2, 2]):
+        elif not self.face_found():
             return
         # else: -> While measuring
         else:
-            cv2.putText(
-                self.frame_out, "Press 'A' to stop",
-                (10, 25), cv2.FONT_HERSHEY_PLAIN, 1.5, col)
-            # cv2.putText(self.frame_out, "Records: {0} / {1}".format(self.counter, self.data[u"number_of_records"]),
-            #            (10, 75), cv2.FONT_HERSHEY_PLAIN, 1.5, col)
-            cv2.putText(self.frame_out, "Press 'Esc' to quit",
-                        (10, 50), cv2.FONT_HERSHEY_PLAIN, 1.5, col)
-
             forehead1 = self.get_subface_coord(0.5, 0.18, 0.25, 0.15)
-            self.draw_rect(forehead1)
-
-            vals = self.get_subface_means(forehead1)
-
-            self.data_buffer.append(vals)
-            L = len(self.data_buffer)
-            # If Data Buffer length is greater than
-            # specified Buffer size, discard oldest measurements
-            if L > self.buffer_size:
-                self.data_buffer = self.data_buffer[-self.buffer_size:]
-                self.times = self.times[-self.buffer_size:]
-                L = self.buffer_size
-
-            processed = np.array(self.data_buffer)
-            # self.samples are used for make_bpm_plot and write_csv
-            self.samples = processed
-            # If there are more than 10 measurements, calculate bpm
-            if L > 10:
-                self.output_dim = processed.shape[0]
-
-                self.fps = float(L) / (self.times[-1] - self.times[0])
-                even_times = np.linspace(self.times[0], self.times[-1], L)
-                interpolated = np.interp(even_times, self.times, processed)
-                interpolated = np.hamming(L) * interpolated
-                interpolated = interpolated - np.mean(interpolated)
-                raw = np.fft.rfft(interpolated)
-                phase = np.angle(raw)
-                self.fft = np.abs(raw)
-                self.freqs = float(self.fps) / L * np.arange(L / 2 + 1)
-                freqs = 60. * self.freqs
-                idx = np.where((freqs > 50) & (freqs < 180))
-
-                pruned = self.fft[idx]
-                phase = phase[idx]
-
-                pfreq = freqs[idx]
-                self.freqs = pfreq
-                self.fft = pruned
-                if pruned.any():
-                    idx2 = np.argmax(pruned)
+            if self.draw_overlay:
+                cv2.putText(
+                    self.frame_out, "Press 'A' to stop",
+                    (10, 25), cv2.FONT_HERSHEY_PLAIN, 1.5, col)
+                # cv2.putText(self.frame_out, "Records: {0} / {1}".format(self.counter, self.data[u"number_of_records"]),
+                #            (10, 75), cv2.FONT_HERSHEY_PLAIN, 1.5, col)
+                cv2.putText(self.frame_out, "Press 'Esc' to quit",
+                            (10, 50), cv2.FONT_HERSHEY_PLAIN, 1.5, col)
+                self.draw_rect(forehead1)
+
+            with self.profiler.stage("sample"):
+                vals = self.get_subface_sample(forehead1)
+
+                # Ring buffer keeps only the newest buffer_size measurements
+                self.data_buffer.append(timestamp, vals)
+                if self.sliding_dft is not None:
+                    self.sliding_dft.update(timestamp, vals)
                 else:
-                    return
-
-                t = (np.sin(phase[idx2]) + 1.) / 2.
-                t = 0.9 * t + 0.1
-                alpha = t
-                beta = 1 - t
-
-                self.bpm = self.freqs[idx2]
-                self.idx += 1
-
-                x, y, w, h = self.get_subface_coord(0.5, 0.18, 0.25, 0.15)
-                r = alpha * self.frame_in[y:y + h, x:x + w, 0]
-                g = alpha * \
-                    self.frame_in[y:y + h, x:x + w, 1] + \
-                    beta * self.gray[y:y + h, x:x + w]
-                b = alpha * self.frame_in[y:y + h, x:x + w, 2]
-                self.frame_out[y:y + h, x:x + w] = cv2.merge([r, g, b])
-                x1, y1, w1, h1 = self.face_rect
-                self.slices = [np.copy(self.frame_out[y1:y1 + h1, x1:x1 + w1, 1])]
-
-                #######################################################################################
-
-                # get time gap to data[u"record_length"]
-                self.time_gap = self.end_time - self.get_current_time()
-
-                # "Fix" not to show remaining time
-                self.time_gap = 0
-
-                self.heart_rates.append(self.bpm)
+                    for t_grid, x in self.resampler.update(timestamp, vals):
+                        self.uniform_buffer.append(t_grid, x)
+            L = len(self.data_buffer)
 
-                if self.time_gap:
-                    text = "(estimate: %0.1f bpm, wait %0.0f s)" % (self.bpm, self.time_gap)
-                else:
-                    text = "(estimate: %0.1f bpm)" % (self.bpm)
-                cv2.putText(self.frame_out, text,
-                            (x - w / 2, y), cv2.FONT_HERSHEY_PLAIN, 1, col)
+            processed = self.data_buffer.samples
+            # self.times and self.samples are used for make_bpm_plot and write_csv
+            self.times = self.data_buffer.times
+            self.samples = processed
+            # If there are more than 10 measurements, calculate bpm, but
+            # only as often as the estimate scheduler allows. In between,
+            # the last estimate is reused for the overlay.
+            if L > 10 and self.scheduler.due(timestamp):
+                with self.profiler.stage("estimate"):
+                    self.estimate_bpm(processed)
+            if self.alpha is not None and self.draw_overlay:
+                with self.profiler.stage("overlay"):
+                    self.draw_estimate()
+
+    def estimate_bpm(self, processed):
+        """
+        Runs the spectral analysis over the buffered samples and picks the
+        heart-rate peak. Returns False if no estimate could be made.
+        """
+        self.output_dim = processed.shape[0]
+
+        if self.sliding_dft is not None:
+            # Streaming estimate, updated per sample in O(bins)
+            spectrum = self.sliding_dft.spectrum()
+            if spectrum is None:
+                return False
+            self.fps = self.sliding_dft.rate
+        else:
+            if self.resampler.rate is None:
+                return False
+            self.fps = self.resampler.rate
+            uniform = self.uniform_buffer.samples
+            # The buffer only grows until the face is lost, so the window
+            # only delays the first estimate
+            if self.adaptive_window and len(uniform) < self.window:
+                return False
+            spectrum = band_spectrum(uniform, self.fps)
+
+        self.freqs, self.fft, phase = spectrum
+        pruned = self.fft
+        if pruned.any():
+            idx2 = np.argmax(pruned)
+        else:
+            return False
+
+        t = (np.sin(phase[idx2]) + 1.) / 2.
+        t = 0.9 * t + 0.1
+        self.alpha = t
+
+        self.bpm = self.refine_bpm(idx2)
+        self.confidence = peak_confidence(self.fft, idx2)
+        self.reliable = self.confidence >= self.min_confidence
+        if self.adaptive_window and not self.settled:
+            # A peak on the edge of the band cannot be localized, the true
+            # peak may lie between the band limit and the first bin
+            if self.window < self.buffer_size and \
+                    (idx2 == 0 or idx2 == len(self.fft) - 1):
+                self.reliable = False
+            if not self.reliable:
+                self.window = min(int(self.window * 1.5), self.buffer_size)
+                return False
+            self.settled = True
+        elif not self.adaptive_window and not self.reliable:
+            return False
+        self.idx += 1
+        self.heart_rates.append(self.bpm)
+        return True
+
+    def reset_window(self):
+        """
+        Makes the first estimate wait for min_window samples again
+        """
+        if self.adaptive_window:
+            self.window = self.min_window
+        # Whether the first estimate has been made
+        self.settled = False
+        self.confidence = 0.
+        self.reliable = False
+
+    def refine_bpm(self, idx2):
+        """
+        Estimated bpm for the peak bin idx2 of self.fft, refined below the
+        bin spacing if peak_refinement is set
+        """
+        bpm = self.freqs[idx2]
+        if self.peak_refinement == "parabolic" and len(self.freqs) > 1:
+            step = self.freqs[1] - self.freqs[0]
+            bpm += peak_offset(self.fft, idx2) * step
+        elif self.peak_refinement == "zoom" and len(self.freqs) > 1:
+            step = self.freqs[1] - self.freqs[0]
+            if self.sliding_dft is not None:
+                uniform = self.sliding_dft.uniform.samples
+            else:
+                uniform = self.uniform_buffer.samples
+            bpm = zoom_peak(uniform, self.fps, bpm, step)
+        return bpm
+
+    def draw_estimate(self):
+        """
+        Pulses the forehead region with the phase of the last estimate and
+        prints the estimated bpm.
+        """
+        col = (100, 255, 100)
+        alpha = self.alpha
+        beta = 1 - alpha
+
+        x, y, w, h = self.get_subface_coord(0.5, 0.18, 0.25, 0.15)
+        # Grayscale is only needed for the forehead patch
+        gray = gray_region(self.frame_in, (x, y, w, h))
+        if self.equalize_overlay:
+            # Equalized with the histogram of the face and its surroundings,
+            # sampled at every 4th pixel, rather than of the whole frame.
+            # The histogram of the forehead patch alone would stretch its
+            # contrast much further, and flicker.
+            px, py, pw, ph = pad_rect(self.face_rect, 1., self.frame_in.shape)
+            sample = np.ascontiguousarray(
+                self.frame_in[py:py + ph:4, px:px + pw:4])
+            gray = cv2.LUT(gray, equalization_lut(gray_region(sample)))
+        r = alpha * self.frame_in[y:y + h, x:x + w, 0]
+        g = alpha * \
+            self.frame_in[y:y + h, x:x + w, 1] + \
+            beta * gray
+        b = alpha * self.frame_in[y:y + h, x:x + w, 2]
+        self.frame_out[y:y + h, x:x + w] = cv2.merge([r, g, b])
+        x1, y1, w1, h1 = self.face_rect
+        self.slices = [np.copy(self.frame_out[y1:y1 + h1, x1:x1 + w1, 1])]
+
+        #######################################################################################
+
+        # get time gap to data[u"record_length"]
+        self.time_gap = self.end_time - self.get_current_time()
+
+        # "Fix" not to show remaining time
+        self.time_gap = 0
+
+        if not self.reliable:
+            text = "(estimate: %0.1f bpm, low confidence)" % (self.bpm)
+        elif self.time_gap:
+            text = "(estimate: %0.1f bpm, wait %0.0f s)" % (self.bpm, self.time_gap)
+        else:
+            text = "(estimate: %0.1f bpm)" % (self.bpm)
+        cv2.putText(self.frame_out, text,
+                    (x - w / 2, y), cv2.FONT_HERSHEY_PLAIN, 1, col)
 
     def detect_face(self):
         col = (100, 255, 100)
 
+        # Locate the face before any text is drawn into the frame
+        detected = self.face_tracker.update(self.frame_in)
+
+        self.data_buffer.clear()
+        if self.sliding_dft is not None:
+            self.sliding_dft.reset()
+        self.resampler.reset()
+        self.uniform_buffer.clear()
+        self.scheduler.reset()
+        self.reset_window()
+        self.alpha = None
+        self.times = self.data_buffer.times
+        self.samples = self.data_buffer.samples
+        self.trained = False
+
+        if detected is not None:
+            if self.shift(detected) > 10:
+                self.face_rect = detected
+        if not self.draw_overlay:
+            return
+
         cv2.putText(self.frame_out, "Press 'S' to lock face and begin", (10, 25), cv2.FONT_HERSHEY_PLAIN, 1.25, col)
         cv2.putText(self.frame_out, "Press 'Esc' to quit", (10, 50), cv2.FONT_HERSHEY_PLAIN, 1.25, col)
-        self.data_buffer, self.times, self.trained = [], [], False
-        detected = list(self.face_cascade.detectMultiScale(self.gray,
-                                                           scaleFactor=1.3,
-                                                           minNeighbors=4,
-                                                           minSize=(
-                                                               50, 50),
-                                                           flags=cv2.CASCADE_SCALE_IMAGE))
-
-        if len(detected) > 0:
-            detected.sort(key=lambda a: a[-1] * a[-2])
-
-            if self.shift(detected[-1]) > 10:
-                self.face_rect = detected[-1]
         forehead1 = self.get_subface_coord(0.5, 0.18, 0.25, 0.15)
         self.draw_rect(self.face_rect, col=(255, 0, 0))
         x, y, w, h = self.face_rect
@@ -270,3 +466,178 @@ class findFaceGetPulse(object):
 
         current = datetime(year=year, month=month, day=day, hour=hour, minute=minute, second=second)
         return (current - datetime(1970, 1, 1)).total_seconds()
+
+
+class PulseTrack(object):
+
+    """
+    One subject followed by findFacesGetPulse: its face rectangle, forehead
+    signal buffer and latest estimate.
+    """
+
+    def __init__(self, track_id, rect, buffer_size):
+        self.id = track_id
+        self.rect = rect
+        self.last_center = np.array([rect[0] + 0.5 * rect[2],
+                                     rect[1] + 0.5 * rect[3]])
+        self.data_buffer = RingBuffer(buffer_size)
+        self.missed = 0
+        self.bpm = 0
+        self.freqs = []
+        self.fft = []
+
+    def move(self, rect, smoothness):
+        """
+        Moves the track to a new detection, ignoring shifts of the face
+        center below smoothness pixels so the forehead stays still.
+        """
+        x, y, w, h = rect
+        center = np.array([x + 0.5 * w, y + 0.5 * h])
+        if np.linalg.norm(center - self.last_center) > smoothness:
+            self.rect = rect
+            self.last_center = center
+        self.missed = 0
+
+
+class findFacesGetPulse(object):
+
+    """
+    Multi-subject variant of findFaceGetPulse.
+
+    All faces are detected in one cascade pass every detect_every frames and
+    matched to existing tracks by overlap, so every subject keeps a stable
+    track id. Each track has its own forehead signal buffer; the forehead
+    means of all tracks are sampled from one integral image per frame, and
+    tracks with the same number of samples (and therefore the same
+    timestamps) are analysed together in one batched rfft.
+
+    Tracks missing from max_missed consecutive detection passes are dropped.
+    """
+
+    def __init__(self, buffer_size=250, detect_every=10,
+                 detection_width=None, max_missed=3,
+                 face_detector_smoothness=10, estimate_rate=None,
+                 estimate_every=1, channel=None, refine_peaks=False):
+        self.frame_in = np.zeros((10, 10))
+        self.frame_out = np.zeros((10, 10))
+        self.buffer_size = buffer_size
+        self.refine_peaks = refine_peaks
+        self.detect_every = max(int(detect_every), 1)
+        self.detection_width = detection_width
+        self.max_missed = max_missed
+        self.smoothness = face_detector_smoothness
+        self.channel = channel
+        self.scheduler = EstimateScheduler(rate=estimate_rate,
+                                           every=estimate_every)
+        self._face_cascade = None
+        self.t0 = time.time()
+
+        self.tracks = []
+        self.next_id = 1
+        self.frames = 0
+
+    @property
+    def face_cascade(self):
+        if self._face_cascade is None:
+            self._face_cascade = load_face_cascade()
+        return self._face_cascade
+
+    def run(self, cam, timestamp=None):
+        """
+        Function used to process single image received from camera.
+        timestamp (as returned by time.time()) is when the frame was
+        grabbed; it defaults to now.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        timestamp = timestamp - self.t0
+        self.frame_out = self.frame_in
+
+        if self.frames % self.detect_every == 0:
+            self.update_tracks()
+        self.frames += 1
+
+        if self.tracks:
+            foreheads = [subface_coord(track.rect, 0.5, 0.18, 0.25, 0.15)
+                         for track in self.tracks]
+            means = roi_means(self.frame_in, foreheads)
+            if self.channel is None:
+                vals = means.mean(axis=1)
+            else:
+                vals = means[:, self.channel]
+            for track, val in zip(self.tracks, vals):
+                track.data_buffer.append(timestamp, val)
+
+            if self.scheduler.due(timestamp):
+                self.estimate_bpms()
+
+        self.draw_tracks()
+
+    def update_tracks(self):
+        """
+        Detects all faces and matches them to the current tracks
+        """
+        scale = detection_scale(self.frame_in.shape[1], self.detection_width)
+        detected = detect_faces(self.face_cascade, self.frame_in, scale)
+        matches = match_rects([track.rect for track in self.tracks],
+                              detected)
+        matched_tracks = set(i for i, _ in matches)
+        matched_faces = set(j for _, j in matches)
+
+        for i, j in matches:
+            self.tracks[i].move(detected[j], self.smoothness)
+        for i, track in enumerate(self.tracks):
+            if i not in matched_tracks:
+                track.missed += 1
+        self.tracks = [track for track in self.tracks
+                       if track.missed < self.max_missed]
+        for j, rect in enumerate(detected):
+            if j not in matched_faces:
+                self.tracks.append(PulseTrack(self.next_id, rect,
+                                              self.buffer_size))
+                self.next_id += 1
+
+    def estimate_bpms(self):
+        """
+        Batched spectral analysis over every track with more than 10
+        samples
+        """
+        groups = {}
+        for track in self.tracks:
+            L = len(track.data_buffer)
+            if L > 10:
+                groups.setdefault(L, []).append(track)
+
+        for L, tracks in groups.items():
+            times = tracks[0].data_buffer.times
+            samples = np.array([track.data_buffer.samples
+                                for track in tracks])
+            fps = float(L) / (times[-1] - times[0])
+            freqs, fft, _ = band_spectrum(resample_uniform(times, samples),
+                                          fps)
+            if not len(freqs):
+                continue
+            peaks = np.argmax(fft, axis=1)
+            bpms = freqs[peaks]
+            if self.refine_peaks and len(freqs) > 1:
+                bpms = bpms + peak_offset(fft, peaks) * (freqs[1] - freqs[0])
+            for track, row, bpm in zip(tracks, fft, bpms):
+                track.freqs, track.fft = freqs, row
+                if row.any():
+                    track.bpm = bpm
+
+    def draw_tracks(self):
+        col = (100, 255, 100)
+        for track in self.tracks:
+            x, y, w, h = track.rect
+            cv2.rectangle(self.frame_out, (x, y), (x + w, y + h),
+                          (255, 0, 0), 1)
+            fx, fy, fw, fh = subface_coord(track.rect, 0.5, 0.18, 0.25, 0.15)
+            cv2.rectangle(self.frame_out, (fx, fy), (fx + fw, fy + fh),
+                          (0, 255, 0), 1)
+            if track.bpm:
+                text = "#%d (estimate: %0.1f bpm)" % (track.id, track.bpm)
+            else:
+                text = "#%d" % track.id
+            cv2.putText(self.frame_out, text,
+                        (x, y), cv2.FONT_HERSHEY_PLAIN, 1.25, col)
@@ -0,0 +1,231 @@
+import BaseHTTPServer
+import csv
+import json
+import threading
+import time
+from collections import deque
+from timeit import default_timer
+
+import numpy as np
+
+"""
+Per-stage timing of the processing loop.
+
+A Profiler collects the durations of named stages (capture, detection,
+spectral estimate, overlay drawing, rendering, network...) into rolling
+windows and summarizes them as percentiles, together with event rates
+(loop and camera frames per second) and counters (dropped frames). The
+summary can be exported to JSON or CSV, or served as JSON over HTTP on a
+local port.
+
+Components hold NULL_PROFILER by default, whose hooks do nothing, so the
+instrumentation costs nothing unless profiling was asked for.
+"""
+
+PERCENTILES = (50, 95, 99)
+
+
+class _Stage(object):
+    """
+    Context manager timing one pass through a stage
+    """
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = default_timer()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, default_timer() - self.start)
+        return False
+
+
+class Profiler(object):
+
+    """
+    Rolling per-stage timers, event rates and counters.
+
+    Durations and event times are kept for the newest window entries of
+    each name. All methods may be called from several threads.
+    """
+
+    def __init__(self, window=1000):
+        self.window = window
+        self.started = time.time()
+        self._durations = {}
+        self._events = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+        self._server = None
+
+    def stage(self, name):
+        """
+        Returns a context manager that times the enclosed block as name
+        """
+        return _Stage(self, name)
+
+    def record(self, name, duration):
+        """
+        Adds a duration (seconds) to the stage name
+        """
+        with self._lock:
+            if name not in self._durations:
+                self._durations[name] = deque(maxlen=self.window)
+            self._durations[name].append(duration)
+
+    def tick(self, name):
+        """
+        Marks one occurrence of the event name (e.g. a processed frame), used
+        to report its rate
+        """
+        with self._lock:
+            if name not in self._events:
+                self._events[name] = deque(maxlen=self.window)
+            self._events[name].append(default_timer())
+
+    def count(self, name, n=1):
+        """
+        Adds n to the counter name
+        """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def summary(self):
+        """
+        Returns a dict with, per stage, the number of samples and the mean,
+        percentiles and maximum duration in milliseconds, per event the
+        rate (Hz) over the rolling window, and the counters.
+        """
+        with self._lock:
+            durations = dict((name, np.array(values))
+                             for name, values in self._durations.items())
+            events = dict((name, np.array(values))
+                          for name, values in self._events.items())
+            counters = dict(self._counters)
+
+        stages = {}
+        for name, values in durations.items():
+            if not len(values):
+                continue
+            ms = 1000. * values
+            stats = {"n": len(ms), "mean": float(ms.mean()),
+                     "max": float(ms.max())}
+            for p, value in zip(PERCENTILES, np.percentile(ms, PERCENTILES)):
+                stats["p%d" % p] = float(value)
+            stages[name] = stats
+
+        rates = {}
+        for name, times in events.items():
+            if len(times) > 1 and times[-1] > times[0]:
+                rates[name] = (len(times) - 1) / float(times[-1] - times[0])
+            else:
+                rates[name] = 0.
+
+        return {"uptime": time.time() - self.started,
+                "stages": stages,
+                "rates": rates,
+                "counters": counters}
+
+    def write_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=2, sort_keys=True)
+
+    def write_csv(self, path):
+        """
+        Writes one row per stage (durations in ms), followed by one row per
+        rate and counter
+        """
+        summary = self.summary()
+        columns = ["n", "mean"] + ["p%d" % p for p in PERCENTILES] + ["max"]
+        with open(path, "wb") as f:
+            writer = csv.writer(f)
+            writer.writerow(["name"] + columns)
+            for name in sorted(summary["stages"]):
+                stats = summary["stages"][name]
+                writer.writerow([name] + ["%.3f" % stats[c] if c != "n"
+                                          else stats[c] for c in columns])
+            writer.writerow([])
+            writer.writerow(["name", "value"])
+            for name in sorted(summary["rates"]):
+                writer.writerow([name + "_hz", "%.2f" % summary["rates"][name]])
+            for name in sorted(summary["counters"]):
+                writer.writerow([name, summary["counters"][name]])
+
+    def export(self, path):
+        """
+        Writes the summary to path, as CSV if it ends in .csv and JSON
+        otherwise
+        """
+        if path.lower().endswith(".csv"):
+            self.write_csv(path)
+        else:
+            self.write_json(path)
+
+    def serve(self, port, host="127.0.0.1"):
+        """
+        Serves the JSON summary over HTTP on host:port from a daemon thread
+        """
+        profiler = self
+
+        class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = json.dumps(profiler.summary(), sort_keys=True)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = BaseHTTPServer.HTTPServer((host, port), MetricsHandler)
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self._server.server_address
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+class _NullStage(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class NullProfiler(object):
+
+    """
+    Profiler interface that records nothing
+    """
+
+    _stage = _NullStage()
+
+    def stage(self, name):
+        return self._stage
+
+    def record(self, name, duration):
+        pass
+
+    def tick(self, name):
+        pass
+
+    def count(self, name, n=1):
+        pass
+
+    def close(self):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
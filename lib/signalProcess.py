@@ -0,0 +1,484 @@
+import numpy as np
+
+"""
+Time-series containers & spectral helpers used by the pulse processors
+"""
+
+
+class RingBuffer(object):
+
+    """
+    Fixed-capacity buffer of (time, sample) pairs backed by preallocated
+    numpy arrays.
+
+    Every value is written twice, at its slot and at slot + capacity, so the
+    most recent samples are always available as a single contiguous view
+    (oldest first) without copying or reallocating on append.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = int(capacity)
+        self._times = np.zeros(2 * self.capacity)
+        self._samples = np.zeros(2 * self.capacity)
+        self._start = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def is_full(self):
+        return self._count == self.capacity
+
+    def clear(self):
+        self._start = 0
+        self._count = 0
+
+    def append(self, t, value):
+        if self._count < self.capacity:
+            slot = self._count
+            self._count += 1
+        else:
+            slot = self._start
+            self._start = (self._start + 1) % self.capacity
+        self._times[slot] = self._times[slot + self.capacity] = t
+        self._samples[slot] = self._samples[slot + self.capacity] = value
+
+    @property
+    def times(self):
+        """
+        View of the stored timestamps, oldest first
+        """
+        return self._times[self._start:self._start + self._count]
+
+    @property
+    def samples(self):
+        """
+        View of the stored samples, oldest first
+        """
+        return self._samples[self._start:self._start + self._count]
+
+
+# Heart-rate band (beats per minute) searched for the spectral peak
+BPM_LIMITS = (50, 180)
+
+
+_hamming_windows = {}
+
+
+def hamming_window(L):
+    """
+    np.hamming(L), computed once per length
+    """
+    window = _hamming_windows.get(L)
+    if window is None:
+        window = _hamming_windows[L] = np.hamming(L)
+    return window
+
+
+def band_spectrum(samples, rate, bpm_limits=BPM_LIMITS):
+    """
+    Hamming-windowed, mean-removed spectrum of evenly spaced samples, pruned
+    to the heart-rate band.
+
+    Works along the last axis, so a 2-d array of equal-length windows is
+    analysed in a single batched rfft. Returns (freqs in bpm, magnitude,
+    phase).
+    """
+    samples = np.asarray(samples, dtype=np.float64)
+    L = samples.shape[-1]
+    windowed = hamming_window(L) * samples
+    windowed = windowed - np.mean(windowed, axis=-1)[..., np.newaxis]
+    raw = np.fft.rfft(windowed)
+    freqs = 60. * float(rate) / L * np.arange(L // 2 + 1)
+    idx = np.where((freqs > bpm_limits[0]) & (freqs < bpm_limits[1]))[0]
+    pruned = raw[..., idx]
+    return freqs[idx], np.abs(pruned), np.angle(pruned)
+
+
+def peak_offset(magnitude, idx):
+    """
+    Fractional bin offset of the spectral peak at idx, from a parabola
+    fitted through the log magnitude of the peak bin and its neighbours.
+    Peaks on the edge of the band get no offset.
+
+    magnitude may be 2-d with one row (and one idx) per spectrum.
+    """
+    magnitude = np.asarray(magnitude, dtype=np.float64)
+    rows = np.atleast_2d(magnitude)
+    idx = np.atleast_1d(idx)
+    n = rows.shape[1]
+    inner = (idx > 0) & (idx < n - 1)
+    i = np.clip(idx, 1, max(n - 2, 1))
+    r = np.arange(len(rows))
+    eps = 1e-12
+    a = np.log(rows[r, np.minimum(i - 1, n - 1)] + eps)
+    b = np.log(rows[r, np.minimum(i, n - 1)] + eps)
+    c = np.log(rows[r, np.minimum(i + 1, n - 1)] + eps)
+    denom = a - 2 * b + c
+    offset = np.divide(0.5 * (a - c), denom, out=np.zeros(len(rows)),
+                       where=inner & (denom < 0))
+    offset = np.clip(offset, -0.5, 0.5)
+    return offset if magnitude.ndim > 1 else offset[0]
+
+
+def peak_confidence(magnitude, idx):
+    """
+    Prominence of the spectral peak at idx, from 0 to 1: the share of the
+    band power within one bin of the peak, rescaled so that a flat spectrum
+    scores 0 and a pure tone close to 1.
+
+    magnitude may be 2-d with one row (and one idx) per spectrum.
+    """
+    magnitude = np.asarray(magnitude, dtype=np.float64)
+    power = np.atleast_2d(magnitude) ** 2
+    idx = np.atleast_1d(idx)
+    n = power.shape[1]
+    r = np.arange(len(power))
+    has_left, has_right = idx > 0, idx < n - 1
+    peak = power[r, idx] + \
+        np.where(has_left, power[r, np.maximum(idx - 1, 0)], 0.) + \
+        np.where(has_right, power[r, np.minimum(idx + 1, n - 1)], 0.)
+    lobe = 1. + has_left + has_right
+    total = power.sum(axis=1)
+    share = np.divide(peak, total, out=np.zeros(len(power)), where=total > 0)
+    chance = lobe / n
+    score = np.divide(share - chance, 1. - chance, out=np.zeros(len(power)),
+                      where=chance < 1.)
+    score = np.clip(score, 0., 1.)
+    return score if magnitude.ndim > 1 else score[0]
+
+
+def zoom_peak(samples, rate, bpm, span, resolution=0.1):
+    """
+    Refines a spectral peak by evaluating the Hamming-windowed DTFT of the
+    evenly spaced samples on a fine grid (resolution bpm) within span bpm
+    of bpm. Costs O(len(samples) * 2 * span / resolution), independent of
+    the FFT length.
+    """
+    samples = np.asarray(samples, dtype=np.float64)
+    L = len(samples)
+    # Off the FFT bins a constant offset no longer cancels, so the mean is
+    # removed before windowing
+    windowed = hamming_window(L) * (samples - np.mean(samples))
+    grid = np.arange(bpm - span, bpm + span + 0.5 * resolution, resolution)
+    basis = np.exp(-2j * np.pi * np.outer(grid / (60. * rate), np.arange(L)))
+    return grid[np.argmax(np.abs(basis.dot(windowed)))]
+
+
+def resample_uniform(times, samples):
+    """
+    Linearly resamples samples onto len(times) evenly spaced times spanning
+    times, like np.interp. samples may be 2-d, with one row per signal that
+    shares the same timestamps.
+    """
+    times = np.asarray(times, dtype=np.float64)
+    L = len(times)
+    even_times = np.linspace(times[0], times[-1], L)
+    idx = np.clip(np.searchsorted(times, even_times, side="right") - 1,
+                  0, L - 2)
+    span = times[idx + 1] - times[idx]
+    weight = np.divide(even_times - times[idx], span,
+                       out=np.zeros(L), where=span > 0)
+    weight = np.clip(weight, 0., 1.)
+    return samples[..., idx] * (1. - weight) + samples[..., idx + 1] * weight
+
+
+class UniformResampler(object):
+
+    """
+    Incremental linear resampling of an irregularly sampled signal onto an
+    evenly spaced grid.
+
+    The grid rate is fixed from the first min_samples timestamps, after which
+    each new raw sample only interpolates the grid points between it and the
+    previous raw sample; nothing already resampled is touched again.
+
+    Timing jitter is tracked explicitly: jitter is the standard deviation of
+    the raw sample intervals, and gaps counts intervals longer than max_gap
+    grid steps (dropped frames), which are bridged by linear interpolation.
+    """
+
+    def __init__(self, min_samples=10, max_gap=3.):
+        self.min_samples = min_samples
+        self.max_gap = max_gap
+        self.reset()
+
+    def reset(self):
+        self.rate = None
+        self.gaps = 0
+        self._pending = []
+        self._last = None
+        self._origin = 0.
+        self._n = 0
+        self._intervals = 0
+        self._interval_mean = 0.
+        self._interval_m2 = 0.
+
+    @property
+    def jitter(self):
+        """
+        Standard deviation of the raw sample intervals, in seconds
+        """
+        if self._intervals < 2:
+            return 0.
+        return np.sqrt(self._interval_m2 / (self._intervals - 1))
+
+    def update(self, t, value):
+        """
+        Adds one raw (time, value) sample and returns the list of new
+        (grid time, value) samples it completes.
+        """
+        if self.rate is None:
+            self._pending.append((t, value))
+            span = t - self._pending[0][0]
+            if len(self._pending) < self.min_samples or span <= 0:
+                return []
+            self.rate = (len(self._pending) - 1) / float(span)
+            pending, self._pending = self._pending, []
+            self._origin = pending[0][0]
+            self._last = pending[0]
+            resampled = []
+            for t_, value_ in pending:
+                resampled.extend(self._resample(t_, value_))
+            return resampled
+        return self._resample(t, value)
+
+    def _resample(self, t, value):
+        t_prev, value_prev = self._last
+        if t > t_prev:
+            self._track_interval(t - t_prev)
+        resampled = []
+        while True:
+            t_grid = self._origin + self._n / self.rate
+            if t_grid > t:
+                break
+            if t > t_prev:
+                x = value_prev + (value - value_prev) * \
+                    (t_grid - t_prev) / (t - t_prev)
+            else:
+                x = value
+            resampled.append((t_grid, x))
+            self._n += 1
+        self._last = (t, value)
+        return resampled
+
+    def _track_interval(self, interval):
+        if interval > self.max_gap / self.rate:
+            self.gaps += 1
+        # Welford's running variance
+        self._intervals += 1
+        delta = interval - self._interval_mean
+        self._interval_mean += delta / self._intervals
+        self._interval_m2 += delta * (interval - self._interval_mean)
+
+
+class SlidingDFT(object):
+
+    """
+    Streaming heart-rate band spectrum of an irregularly sampled signal.
+
+    Incoming samples are resampled onto a uniform grid by a
+    UniformResampler. Each uniform sample then updates only the DFT bins of
+    the heart-rate band (plus one neighbour on each side for the Hamming
+    kernel), so the cost per sample is O(bins) instead of a full FFT. The
+    bins are recomputed exactly once per window length to stop rounding
+    errors from accumulating.
+
+    Until the window is full, spectrum() falls back to band_spectrum on the
+    samples collected so far.
+    """
+
+    def __init__(self, size, bpm_limits=BPM_LIMITS, min_samples=10):
+        self.size = int(size)
+        self.bpm_limits = bpm_limits
+        self.resampler = UniformResampler(min_samples)
+        self.uniform = RingBuffer(self.size)
+        self.reset()
+
+    @property
+    def rate(self):
+        return self.resampler.rate
+
+    def reset(self):
+        self.resampler.reset()
+        self.uniform.clear()
+        self._freqs = None
+        self._n = 0
+
+    def update(self, t, value):
+        """
+        Adds one raw (time, value) sample
+        """
+        resampled = self.resampler.update(t, value)
+        if resampled and self._freqs is None:
+            self._setup()
+        for t_grid, x in resampled:
+            self._push(t_grid, x)
+
+    def spectrum(self):
+        """
+        Returns (freqs in bpm, magnitude, phase) of the heart-rate band, or
+        None while the sample rate is still unknown.
+        """
+        if self.rate is None:
+            return None
+        if not self.uniform.is_full():
+            return band_spectrum(self.uniform.samples, self.rate,
+                                 self.bpm_limits)
+        # Hamming window applied in the frequency domain
+        X = self._X
+        windowed = 0.54 * X[1:-1] - 0.23 * (X[:-2] + X[2:])
+        return self._freqs, np.abs(windowed), np.angle(windowed)
+
+    def _setup(self):
+        N = self.size
+        freqs = 60. * self.rate / N * np.arange(N // 2 + 1)
+        band = np.where((freqs > self.bpm_limits[0]) &
+                        (freqs < self.bpm_limits[1]))[0]
+        if len(band):
+            bins = np.arange(band[0] - 1, band[-1] + 2)
+        else:
+            bins = np.arange(0)
+        self._freqs = 60. * self.rate / N * bins[1:-1]
+        self._twiddle = np.exp(2j * np.pi * bins / N)
+        self._basis = np.exp(-2j * np.pi * np.outer(bins, np.arange(N)) / N)
+        self._X = np.zeros(len(bins), dtype=np.complex128)
+
+    def _push(self, t, x):
+        if self.uniform.is_full():
+            x_old = self.uniform.samples[0]
+        else:
+            x_old = 0.
+        self.uniform.append(t, x)
+        self._n += 1
+        if self._n % self.size == 0:
+            self._X = self._basis.dot(self.uniform.samples)
+        else:
+            self._X = (self._X + (x - x_old)) * self._twiddle
+
+
+class EstimateScheduler(object):
+
+    """
+    Decides which samples trigger a new spectral estimate.
+
+    An estimate is due once at least `every` samples were added since the
+    previous one and, if `rate` (estimates per second) is set, at least
+    1 / rate seconds have passed. The defaults estimate on every sample.
+    """
+
+    def __init__(self, rate=None, every=1):
+        self.rate = rate
+        self.every = max(int(every), 1)
+        self.reset()
+
+    def reset(self):
+        self._count = 0
+        self._last_time = None
+
+    def due(self, t):
+        """
+        Registers a new sample taken at time t and returns True if the
+        estimate should be refreshed for it.
+        """
+        self._count += 1
+        if self._count < self.every:
+            return False
+        if self.rate and self._last_time is not None and \
+                t - self._last_time < 1. / self.rate:
+            return False
+        self._count = 0
+        self._last_time = t
+        return True
+
+
+def offline_bpm(times, samples, buffer_size=250, bpm_limits=BPM_LIMITS,
+                chunk_size=1024, refine=False):
+    """
+    Heart-rate track of a whole recording, with one estimate per sample.
+
+    For every sample from the 11th on, the window of the last buffer_size
+    samples (fewer while the buffer fills) is resampled evenly over its own
+    span, windowed and transformed, and the strongest bin of the heart-rate band is picked; if
+    the band is empty the previous estimate is kept. All full windows are
+    built as strided views and analysed chunk_size at a time in one batched
+    rfft. With refine=True every peak is refined by peak_offset. Returns an
+    (n, 2) array of (time, bpm).
+    """
+    times = np.asarray(times, dtype=np.float64)
+    samples = np.asarray(samples, dtype=np.float64)
+    n = len(times)
+    bpms = np.full(n, np.nan)
+
+    # Windows that are still filling up each have their own length
+    for end in range(10, min(buffer_size - 1, n)):
+        L = end + 1
+        window = times[:L]
+        fps = float(L) / (window[-1] - window[0])
+        freqs, fft, _ = band_spectrum(resample_uniform(window, samples[:L]),
+                                      fps, bpm_limits)
+        if fft.any():
+            peak = np.argmax(fft)
+            bpms[end] = freqs[peak]
+            if refine and len(freqs) > 1:
+                bpms[end] += peak_offset(fft, peak) * (freqs[1] - freqs[0])
+
+    L = buffer_size
+    if n >= L:
+        hamming = hamming_window(L)
+        position = np.linspace(0., 1., L)
+        k = np.arange(L // 2 + 1)
+        stride = times.strides[0]
+        for start in range(0, n - L + 1, chunk_size):
+            count = min(chunk_size, n - L + 1 - start)
+            time_windows = np.lib.stride_tricks.as_strided(
+                times[start:], shape=(count, L), strides=(stride, stride))
+            t_first, t_last = time_windows[:, 0], time_windows[:, -1]
+            fps = L / (t_last - t_first)
+
+            # Resample every window evenly with one global searchsorted
+            even_times = t_first[:, np.newaxis] + \
+                (t_last - t_first)[:, np.newaxis] * position
+            first = start + np.arange(count)[:, np.newaxis]
+            idx = np.clip(np.searchsorted(times, even_times, side="right") - 1,
+                          first, first + L - 2)
+            span = times[idx + 1] - times[idx]
+            weight = np.divide(even_times - times[idx], span,
+                               out=np.zeros(span.shape), where=span > 0)
+            weight = np.clip(weight, 0., 1.)
+            interpolated = samples[idx] * (1. - weight) + \
+                samples[idx + 1] * weight
+
+            windowed = hamming * interpolated
+            windowed -= np.mean(windowed, axis=1)[:, np.newaxis]
+            fft = np.abs(np.fft.rfft(windowed, axis=1))
+            freqs = 60. * fps[:, np.newaxis] / L * k
+            in_band = (freqs > bpm_limits[0]) & (freqs < bpm_limits[1])
+            fft[~in_band] = 0.
+            peaks = np.argmax(fft, axis=1)
+            rows = np.arange(count)
+            found = fft[rows, peaks] > 0
+            estimates = freqs[rows, peaks]
+            if refine:
+                # Out-of-band bins are zeroed, so edge peaks are not shifted
+                # towards them
+                offsets = peak_offset(fft, peaks)
+                offsets[(fft[rows, np.maximum(peaks - 1, 0)] == 0) |
+                        (fft[rows, np.minimum(peaks + 1, len(k) - 1)] == 0)] = 0.
+                estimates = estimates + offsets * 60. * fps / L
+            bpms[start + L - 1 + rows[found]] = estimates[found]
+
+    # Frames without an estimate keep the previous one
+    valid = ~np.isnan(bpms)
+    last = np.where(valid, np.arange(n), 0)
+    np.maximum.accumulate(last, out=last)
+    filled = np.where(valid[last], bpms[last], 0.)
+    return np.column_stack((times, filled))[10:]
+
+
+def load_samples_csv(path):
+    """
+    Reads the (time, sample) columns written by PulseApp.write_csv
+    """
+    data = np.loadtxt(path, delimiter=',', ndmin=2)
+    return data[:, 0], data[:, 1]
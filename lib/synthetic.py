@@ -0,0 +1,94 @@
+import math
+
+import cv2
+import numpy as np
+
+"""
+Synthetic input for benchmarks and headless runs: a rendered face-like
+pattern whose skin brightness pulses at a known heart rate.
+"""
+
+# Relative strength of the pulse in the B, G and R channels, the green
+# channel carries most of it as in real recordings
+PULSE_WEIGHTS = (0.5, 1., 0.3)
+
+
+def render_face(width=640, height=480, scale=None):
+    """
+    Draws a face-like pattern (skin ellipse, eyes, brows, nose and mouth)
+    that the Haar cascade detects, centred in a width x height BGR frame.
+    The face height is half of the frame height unless scale is given.
+    Returns the frame and the (x, y, w, h) bounding box of the face.
+    """
+    if scale is None:
+        scale = height / 480.
+    s = scale
+    cx, cy = width // 2, height // 2
+    frame = np.full((height, width, 3), 60, np.uint8)
+    fw, fh = int(90 * s), int(120 * s)
+    cv2.ellipse(frame, (cx, cy), (fw, fh), 0, 0, 360, (150, 170, 210), -1)
+    for side in (-1, 1):
+        ex, ey = cx + side * int(38 * s), cy - int(25 * s)
+        cv2.ellipse(frame, (ex, ey - int(18 * s)), (int(25 * s), int(6 * s)),
+                    0, 0, 360, (40, 50, 60), -1)
+        cv2.ellipse(frame, (ex, ey), (int(20 * s), int(10 * s)),
+                    0, 0, 360, (230, 230, 230), -1)
+        cv2.circle(frame, (ex, ey), int(8 * s), (30, 30, 30), -1)
+    nose = np.array([[cx, cy - int(10 * s)],
+                     [cx - int(15 * s), cy + int(30 * s)],
+                     [cx + int(15 * s), cy + int(30 * s)]], np.int32)
+    cv2.fillPoly(frame, [nose], (120, 140, 180))
+    cv2.ellipse(frame, (cx, cy + int(60 * s)), (int(35 * s), int(12 * s)),
+                0, 0, 360, (60, 60, 140), -1)
+    frame = cv2.GaussianBlur(frame, (0, 0), 2 * s)
+    return frame, (cx - fw, cy - fh, 2 * fw, 2 * fh)
+
+
+class SyntheticFace(object):
+
+    """
+    Frames of a rendered face whose skin brightness follows
+    amplitude * sin(2 pi bpm / 60 t), plus gaussian sensor noise of the
+    given standard deviation (both in 8-bit intensity levels).
+
+    The face is drawn once; each frame only re-renders the face bounding
+    box, so generating frames stays cheap next to processing them. Frames
+    for the same t and seed are identical.
+    """
+
+    def __init__(self, width=640, height=480, bpm=72., amplitude=2.,
+                 noise=1., seed=0):
+        self.width = width
+        self.height = height
+        self.bpm = bpm
+        self.amplitude = amplitude
+        self.noise = noise
+        self.seed = seed
+        self.base, self.face_rect = render_face(width, height)
+
+        x, y, w, h = self.face_rect
+        self._box = (slice(max(y, 0), y + h), slice(max(x, 0), x + w))
+        patch = self.base[self._box]
+        # Pulse only the skin, i.e. pixels inside the face ellipse
+        mask = np.zeros(patch.shape[:2], np.uint8)
+        cv2.ellipse(mask, (w // 2, h // 2), (w // 2, h // 2), 0, 0, 360, 1, -1)
+        self._pulse = mask[..., np.newaxis] * \
+            np.array(PULSE_WEIGHTS, np.float32)
+        self._patch = patch.astype(np.float32)
+        self.reset()
+
+    def reset(self):
+        self._rng = np.random.RandomState(self.seed)
+
+    def render(self, t):
+        """
+        Returns the BGR frame at time t (seconds)
+        """
+        frame = self.base.copy()
+        level = self.amplitude * math.sin(2 * math.pi * self.bpm / 60. * t)
+        patch = self._patch + level * self._pulse
+        if self.noise:
+            patch += self.noise * \
+                self._rng.standard_normal(patch.shape).astype(np.float32)
+        frame[self._box] = np.clip(patch + 0.5, 0, 255).astype(np.uint8)
+        return frame